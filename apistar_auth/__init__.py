@@ -3,10 +3,36 @@
 from .auth import (
     AuthorizationHook,
     authorized,
+    DeferredUser,
     Unauthorized,
 )
 
-from .cookies import SESSION_COOKIE_NAME
+from .cache import (
+    disable_session_cache,
+    disable_token_cache,
+    enable_session_cache,
+    enable_token_cache,
+    invalidate_session,
+    invalidate_token,
+    invalidate_user,
+)
+
+from .metrics import (
+    disable_metrics,
+    enable_metrics,
+    reset_metrics,
+    routes as metrics_routes,
+    snapshot as metrics_snapshot,
+)
+
+from .permissions import load_permissions
+
+from .cookies import (
+    disable_signed_session_cookies,
+    enable_signed_session_cookies,
+    SESSION_COOKIE_NAME,
+    SignedSessionCookieHook,
+)
 
 from .models import (
     Token,
@@ -19,11 +45,50 @@ from .login import (
     routes as login_routes
 )
 
+from .signing import Keyring
+
+from .pruning import (
+    disable_session_pruner,
+    enable_session_pruner,
+    SessionPruner,
+)
+
+from .profiling import (
+    disable_query_profiling,
+    enable_query_profiling,
+    profile_queries,
+    query_budget,
+    QueryBudgetExceeded,
+    QueryProfilingHook,
+)
+
+from .replica import disable_read_replica, enable_read_replica
+
+from .storage import enable_compact_storage, migrate_storage
+
+from .stores import (
+    KeyValueSessionStore,
+    MemorySessionStore,
+    SessionStore,
+    SQLSessionStore,
+    set_session_store,
+)
+
 from .tokens import (
+    disable_access_tokens,
+    enable_access_tokens,
+    prune_tokens,
     routes as tokens_routes,
 )
 
+from .touch import (
+    disable_touch_buffer,
+    enable_touch_buffer,
+    TouchBuffer,
+)
+
 from .users import (
+    revoke_signed_sessions,
     routes as users_routes,
     UserInputType,
     UserType,
@@ -31,8 +96,12 @@ from .users import (
 )
 
 from .hasher import (
+    calibrate_bcrypt_hasher,
+    configure_hashing_executor,
     disable_bcrypt_hasher,
     enable_bcrypt_hasher,
+    HasherBusy,
+    set_hasher,
 )
 
 __version__ = '0.5.0'
@@ -46,10 +115,28 @@ __description__ = \
     'Authentication integration based on SQLAlchemy for API Star.'
 
 __all__ = [
-    'AuthorizationHook', 'authorized', 'Unauthorized',
-    'SESSION_COOKIE_NAME',
-    'disable_bcrypt_hasher', 'enable_bcrypt_hasher',
-    'Token',
+    'AuthorizationHook', 'authorized', 'DeferredUser', 'Unauthorized',
+    'load_permissions',
+    'disable_metrics', 'enable_metrics', 'metrics_routes', 'metrics_snapshot',
+    'reset_metrics',
+    'SESSION_COOKIE_NAME', 'SignedSessionCookieHook',
+    'disable_signed_session_cookies', 'enable_signed_session_cookies',
+    'Keyring', 'revoke_signed_sessions',
+    'disable_session_cache', 'disable_token_cache',
+    'enable_session_cache', 'enable_token_cache',
+    'invalidate_session', 'invalidate_token', 'invalidate_user',
+    'calibrate_bcrypt_hasher', 'configure_hashing_executor',
+    'disable_bcrypt_hasher',
+    'enable_bcrypt_hasher', 'HasherBusy', 'set_hasher',
+    'disable_session_pruner', 'enable_session_pruner', 'SessionPruner',
+    'disable_query_profiling', 'enable_query_profiling', 'profile_queries',
+    'query_budget', 'QueryBudgetExceeded', 'QueryProfilingHook',
+    'disable_read_replica', 'enable_read_replica',
+    'enable_compact_storage', 'migrate_storage',
+    'KeyValueSessionStore', 'MemorySessionStore', 'SessionStore',
+    'SQLSessionStore', 'set_session_store',
+    'Token', 'disable_access_tokens', 'enable_access_tokens', 'prune_tokens',
+    'disable_touch_buffer', 'enable_touch_buffer', 'TouchBuffer',
     'User', 'UserInputType', 'UserType', 'UserRole', 'UserSession',
     'UserComponent',
     'routes',
@@ -0,0 +1,475 @@
+'''Asynchronous variants of the user component, login and listing routes,
+for apistar's ASyncApp.
+
+SQLAlchemy 1.3 has no asyncio support, so statements are built with
+SQLAlchemy Core, compiled for SQLite and run through aiosqlite. Values are
+converted by the same column types as the synchronous code, so both can
+share a database, including in compact storage mode. Sessions are always
+kept in the `user_sessions` table.
+
+    app = ASyncApp(
+        routes=aio.routes,
+        components=[AsyncDatabaseComponent(AsyncDatabase('auth.db')),
+                    AsyncUserComponent()],
+        event_hooks=[AsyncAuthorizationHook(aio.routes)],
+    )
+
+'''
+import asyncio
+import inspect
+import time
+import uuid
+from datetime import datetime, timezone
+
+from apistar import Component, Route, http
+from apistar.exceptions import BadRequest
+from apistar.server.asgi import ASGIScope
+from sqlalchemy import select
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import class_mapper
+
+try:
+    import aiosqlite
+except ImportError:  # pragma: no cover
+    aiosqlite = None
+
+from . import hasher
+from . import metrics
+from . import tokens
+from .auth import authorized, AuthorizationHook
+from .cache import session_cache, token_cache
+from .cookies import (
+    decode_signed_session,
+    encode_session,
+    get_request_session_cookie,
+    get_session_cookie,
+    is_revoked,
+)
+from .login import LoginType
+from .models import Token, User, UserSession
+from .pagination import (
+    decode_cursor,
+    fetch_limit,
+    get_limit,
+    keyset_filter,
+    list_response,
+)
+from .storage import utc_now
+from .stores import new_session_id
+from .tokens import decode_access_token, serialize_token
+from . import users
+from .users import (
+    as_utc,
+    attribute_names,
+    DEFERRED_USER_KEY,
+    serialize_user,
+    serialize_user_session,
+)
+
+users_table = User.__table__
+sessions_table = UserSession.__table__
+tokens_table = Token.__table__
+
+# Columns of a user row, in the order of `attribute_names(User)`.
+user_columns = [users_table.c[key] for key in attribute_names(User)]
+
+
+class AsyncDatabase:
+    '''A small pool of aiosqlite connections that runs SQLAlchemy Core
+    statements.
+
+    Bind parameters and result values go through the column types, so
+    statements take and return the same Python values as the ORM.
+
+    '''
+    def __init__(self, path, pool_size=4):
+        if aiosqlite is None:
+            raise ImportError('AsyncDatabase requires aiosqlite')
+
+        self.path = path
+        self.pool_size = pool_size
+        self.dialect = sqlite.dialect()
+        self._idle = []
+        self._slots = None
+
+    async def _acquire(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        await self._slots.acquire()
+        try:
+            if self._idle:
+                return self._idle.pop()
+            return await aiosqlite.connect(self.path)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, conn):
+        self._idle.append(conn)
+        self._slots.release()
+
+    def begin(self):
+        '''Return an async context manager with a connection that commits
+        on success and rolls back on error.'''
+        return _Transaction(self)
+
+    def compile(self, statement):
+        compiled = statement.compile(dialect=self.dialect)
+        params = compiled.construct_params()
+
+        values = []
+        for name in compiled.positiontup:
+            value = params[name]
+            process = compiled.binds[name].type \
+                .dialect_impl(self.dialect).bind_processor(self.dialect)
+            if process is not None:
+                value = process(value)
+            values.append(value)
+        return str(compiled), values
+
+    def result_processors(self, statement):
+        return [(column.key, column.type.dialect_impl(self.dialect)
+                 .result_processor(self.dialect, None))
+                for column in statement.inner_columns]
+
+    async def fetchall(self, statement):
+        async with self.begin() as conn:
+            return await conn.fetchall(statement)
+
+    async def fetchone(self, statement):
+        rows = await self.fetchall(statement.limit(1))
+        return rows[0] if rows else None
+
+    async def execute(self, statement):
+        async with self.begin() as conn:
+            return await conn.execute(statement)
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await conn.close()
+
+
+class AsyncConnection:
+    def __init__(self, database, conn):
+        self.database = database
+        self.conn = conn
+
+    async def execute(self, statement):
+        '''Run a statement and return the number of affected rows.'''
+        sql, params = self.database.compile(statement)
+        cursor = await self.conn.execute(sql, params)
+        try:
+            return cursor.rowcount
+        finally:
+            await cursor.close()
+
+    async def fetchall(self, statement):
+        '''Run a select and return its rows as dicts.'''
+        sql, params = self.database.compile(statement)
+        processors = self.database.result_processors(statement)
+
+        rows = []
+        for row in await self.conn.execute_fetchall(sql, params):
+            record = {}
+            for (key, process), value in zip(processors, row):
+                record[key] = process(value) if process is not None \
+                    else value
+            rows.append(record)
+        return rows
+
+
+class _Transaction:
+    def __init__(self, database):
+        self.database = database
+        self.conn = None
+
+    async def __aenter__(self):
+        self.conn = await self.database._acquire()
+        return AsyncConnection(self.database, self.conn)
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        try:
+            if exc_type is None:
+                await self.conn.commit()
+            else:
+                await self.conn.rollback()
+        finally:
+            self.database._release(self.conn)
+
+
+class AsyncDatabaseComponent(Component):
+    def __init__(self, database: AsyncDatabase) -> None:
+        self.database = database
+
+    def resolve(self) -> AsyncDatabase:
+        return self.database
+
+
+def user_from_row(row):
+    '''Build a User instance, not attached to any session, from a row of
+    `user_columns`.'''
+    user = class_mapper(User).class_manager.new_instance()
+    for key in attribute_names(User):
+        setattr(user, key, row[key])
+    return user
+
+
+class AsyncDeferredUser:
+    '''Like DeferredUser, but resolved with `await user.get()`.'''
+    def __init__(self, resolve):
+        self._resolve = resolve
+        self._task = None
+
+    async def get(self) -> User:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._resolve())
+            self._resolve = None
+        return await self._task
+
+
+class AsyncAuthorizationHook(AuthorizationHook):
+    '''AuthorizationHook for ASyncApp, see AsyncUserComponent.'''
+    async def on_request(self, route: Route, user: AsyncDeferredUser):
+        policy = self.policy(route.handler)
+        if policy is not None:
+            self.check(policy, await user.get())
+
+
+class AsyncUserComponent(Component):
+    '''Resolves the authenticated user without blocking the event loop.
+
+    The user is looked up like UserComponent does: by access token, token
+    query parameter or session cookie, using the session and token caches.
+    Signed session cookies are verified and then looked up like plain
+    session ids; they are not reissued.
+
+    '''
+    def can_handle_parameter(self, parameter: inspect.Parameter):
+        return parameter.annotation in (User, AsyncDeferredUser)
+
+    async def resolve(self, parameter: inspect.Parameter,
+                      request: http.Request, database: AsyncDatabase,
+                      token: http.QueryParam, authorization: http.Header,
+                      scope: ASGIScope
+                      # pylint: disable=arguments-differ
+                      ) -> User:
+        deferred = scope.get(DEFERRED_USER_KEY)
+        if deferred is None:
+            deferred = AsyncDeferredUser(lambda: self.resolve_user(
+                request, database, token, authorization))
+            scope[DEFERRED_USER_KEY] = deferred
+
+        if parameter.annotation is AsyncDeferredUser:
+            return deferred
+        return await deferred.get()
+
+    async def resolve_user(self, request, database, token, authorization):
+        started = time.perf_counter()
+        access_token = tokens.bearer_token(authorization)
+        if access_token or token:
+            method = 'token'
+            user = await self.resolve_with_credentials(database, token,
+                                                       access_token)
+        else:
+            session_id = get_request_session_cookie(request.headers)
+            method = 'cookie' if session_id else 'none'
+            user = await self.resolve_with_cookie(database, session_id) \
+                if session_id else None
+
+        metrics.resolve_seconds.observe(time.perf_counter() - started,
+                                        method)
+        return user
+
+    async def resolve_with_credentials(self, database, token,
+                                       access_token):
+        if access_token:
+            return await self.resolve_with_access_token(database,
+                                                        access_token)
+
+        try:
+            token = uuid.UUID(token)
+        except ValueError:
+            return None
+        return await self.resolve_with_token(database, token)
+
+    async def resolve_with_cookie(self, database, session_id):
+        payload = decode_signed_session(session_id)
+        if payload is not None:
+            if is_revoked(payload):
+                return None
+            user = await self.resolve_with_session(database, payload['sid'])
+            if user is None or user.session_epoch != payload['epoch']:
+                return None
+            return user
+
+        try:
+            session_id = uuid.UUID(session_id)
+        except ValueError:
+            return None
+        return await self.resolve_with_session(database, session_id)
+
+    async def resolve_with_access_token(self, database, access_token):
+        payload = decode_access_token(access_token)
+        if payload is None or is_revoked(payload):
+            return None
+
+        row = await database.fetchone(
+            select(user_columns).where(users_table.c.id == payload['uid']))
+        return None if row is None else user_from_row(row)
+
+    async def resolve_with_token(self, database, token):
+        cached = token_cache.get(token)
+        if cached is not None:
+            snapshot, expires, last_used = cached
+        else:
+            row = await database.fetchone(
+                select(user_columns + [tokens_table.c.expires,
+                                       tokens_table.c.last_used])
+                .select_from(users_table.join(tokens_table))
+                .where(tokens_table.c.id == token))
+            if row is None:
+                return None
+
+            expires = as_utc(row.pop('expires'))
+            last_used = as_utc(row.pop('last_used'))
+            snapshot = row
+
+        now_utc = datetime.now(timezone.utc)
+
+        if expires is not None and expires <= now_utc:
+            token_cache.invalidate(token)
+            return None
+
+        if last_used is None or \
+                now_utc - last_used >= tokens.token_last_used_delay:
+            metrics.touches.inc('token')
+            await database.execute(
+                tokens_table.update()
+                .where(tokens_table.c.id == token)
+                .values(last_used=utc_now()))
+            last_used = now_utc
+            cached = None
+
+        if cached is None:
+            token_cache.set(token, (snapshot, expires, last_used))
+        return user_from_row(snapshot)
+
+    async def resolve_with_session(self, database, session_id):
+        now_utc = datetime.now(timezone.utc)
+
+        cached = session_cache.get(session_id)
+        if cached is not None:
+            snapshot, session_updated = cached
+            if now_utc - session_updated < users.session_update_delay:
+                return user_from_row(snapshot)
+            session_cache.invalidate(session_id)
+
+        columns = user_columns + \
+            [sessions_table.c.updated.label('session_updated')]
+        row = await database.fetchone(
+            select(columns)
+            .select_from(users_table.join(sessions_table))
+            .where(sessions_table.c.id == session_id))
+        if row is None:
+            return None
+
+        session_updated = as_utc(row.pop('session_updated'))
+        if session_updated <= now_utc - users.session_expires_after:
+            return None
+
+        if now_utc - session_updated >= users.session_update_delay:
+            metrics.touches.inc('session')
+            await database.execute(
+                sessions_table.update()
+                .where(sessions_table.c.id == session_id)
+                .values(updated=utc_now()))
+            session_updated = now_utc
+
+        session_cache.set(session_id, (row, session_updated))
+        return user_from_row(row)
+
+
+async def login(database: AsyncDatabase, request: http.Request,
+                data: LoginType) -> http.JSONResponse:
+    row = await database.fetchone(
+        select(user_columns).where(users_table.c.username == data.username))
+    if row is None:
+        metrics.logins.inc('failure')
+        raise BadRequest(dict(error='Invalid username/password'))
+
+    # The password is verified on the hashing executor, not on the loop.
+    verified, new_hash = await hasher.verify_and_update_async(
+        data.password, row['password'])
+    if not verified:
+        metrics.logins.inc('failure')
+        raise BadRequest(dict(error='Invalid username/password'))
+
+    metrics.logins.inc('success')
+
+    session_id = new_session_id()
+    async with database.begin() as conn:
+        if new_hash is not None:
+            row['password'] = new_hash
+            await conn.execute(users_table.update()
+                               .where(users_table.c.id == row['id'])
+                               .values(password=new_hash))
+        await conn.execute(sessions_table.insert()
+                           .values(id=session_id, user_id=row['id']))
+
+    user = user_from_row(row)
+    cookie = get_session_cookie(request.url,
+                                encode_session(session_id, user))
+    headers = {'Set-Cookie': cookie.output(header='')}
+
+    return http.JSONResponse(serialize_user(user), headers=headers)
+
+
+def _keyset_select(statement, columns, after, limit):
+    # Newest first, like SessionStore.list() and tokens.list_tokens().
+    if after is not None:
+        statement = statement.where(keyset_filter(columns, after, True))
+    statement = statement.order_by(*[column.desc() for column in columns])
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
+
+
+async def _list_by_user(database, table, user, url, limit, after, accept,
+                        serialize):
+    limit = get_limit(limit)
+    if after:
+        after = decode_cursor(after, (datetime, uuid.UUID))
+
+    columns = [table.c[key] for key in serialize.fields]
+    statement = _keyset_select(
+        select(columns).where(table.c.user_id == user.id),
+        [table.c.updated, table.c.id], after or None, fetch_limit(limit))
+    rows = await database.fetchall(statement)
+    return list_response(rows, serialize,
+                         lambda row: (row['updated'], row['id']),
+                         url, limit, accept)
+
+
+@authorized
+async def list_user_session(database: AsyncDatabase, user: User,
+                            url: http.URL, limit: http.QueryParam,
+                            after: http.QueryParam,
+                            accept: http.Header) -> http.Response:
+    return await _list_by_user(database, sessions_table, user, url, limit,
+                               after, accept, serialize_user_session)
+
+
+@authorized
+async def list_tokens(database: AsyncDatabase, user: User, url: http.URL,
+                      limit: http.QueryParam, after: http.QueryParam,
+                      accept: http.Header) -> http.Response:
+    return await _list_by_user(database, tokens_table, user, url, limit,
+                               after, accept, serialize_token)
+
+
+routes = [
+    Route('/login', 'POST', login),
+    Route('/users/sessions', 'GET', list_user_session),
+    Route('/tokens', 'GET', list_tokens),
+]
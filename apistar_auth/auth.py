@@ -1,22 +1,40 @@
-from apistar import Route
-from apistar.exceptions import HTTPException
+from apistar import Include, Route
+from apistar.exceptions import ConfigurationError, HTTPException
 
-from .models import User
+from .models import User, UserRole
+from . import permissions
 
 
-def _mark_authorization(f, role=None):
+def _as_set(value):
+    if value is None:
+        return None
+    if isinstance(value, (str, UserRole)):
+        return frozenset([value])
+    return frozenset(value)
+
+
+def _mark_authorization(f, role=None, permission=None):
     f.needs_authorization = True
     if role is not None:
         f.authorized_role = role
+    if permission is not None:
+        f.authorized_permissions = _as_set(permission)
+
+
+def authorized(role=None, permission=None):
+    '''Mark a handler as requiring an authenticated user.
 
+    `role` is a UserRole or a set of roles and `permission` is a named
+    permission or a set of them (see ./permissions.py). The user needs any
+    one of the given roles or permissions.
 
-def authorized(role=None):
+    '''
     if hasattr(role, '__call__'):
         _mark_authorization(role)
         return role
 
     def outer(f):
-        _mark_authorization(f, role)
+        _mark_authorization(f, role, permission)
         return f
     return outer
 
@@ -26,24 +44,110 @@ class Unauthorized(HTTPException):
     default_detail = 'Unauthorized'
 
 
+class DeferredUser:
+    '''Resolves the authenticated user on first use.
+
+    Routes without authorization marker never call `get()`, so they do not
+    pay for cookie or token lookups.
+
+    '''
+    def __init__(self, resolve):
+        self._resolve = resolve
+        self._resolved = False
+        self._user = None
+
+    def get(self) -> User:
+        if not self._resolved:
+            self._user = self._resolve()
+            self._resolved = True
+            self._resolve = None
+        return self._user
+
+
+class RoutePolicy:
+    '''Authorization requirements of a route, compiled from the markers set
+    by `authorized()`. A `mask` of None accepts any authenticated user.'''
+    __slots__ = ('mask', 'names')
+
+    def __init__(self, mask=None, names=()):
+        self.mask = mask
+        self.names = names
+
+
+def compile_policy(handler):
+    '''Return the RoutePolicy of a handler, or None for public routes.'''
+    roles = _as_set(getattr(handler, 'authorized_role', None)) or frozenset()
+    perms = getattr(handler, 'authorized_permissions', None) or frozenset()
+
+    if not hasattr(handler, 'needs_authorization'):
+        if roles or perms:
+            msg = 'handler "{}" has an authorized role but no authorization'
+            raise ConfigurationError(msg.format(handler.__name__))
+        return None
+
+    if not roles and not perms:
+        return RoutePolicy()
+
+    for role in roles:
+        if not isinstance(role, UserRole):
+            msg = 'handler "{}" has an invalid authorized role: {!r}'
+            raise ConfigurationError(msg.format(handler.__name__, role))
+
+    try:
+        mask = permissions.required_mask(roles, perms)
+    except KeyError as exc:
+        msg = 'handler "{}" requires an unknown permission: {}'
+        raise ConfigurationError(msg.format(handler.__name__, exc))
+
+    names = sorted(role.name for role in roles) + sorted(perms)
+    return RoutePolicy(mask, names)
+
+
+def iter_routes(routes):
+    for route in routes:
+        if isinstance(route, Include):
+            yield from iter_routes(route.routes)
+        else:
+            yield route
+
+
 class AuthorizationHook:
-    def on_request(self, route: Route, user: User):
-        handler = route.handler
-        if not hasattr(handler, 'needs_authorization'):
-            return
+    '''Enforce the `authorized()` markers of the matched route.
+
+    When `routes` are given, the policy of every route is compiled up front,
+    so misconfigured routes raise a ConfigurationError at startup. Routes
+    that were not compiled up front are compiled on their first request.
+
+    '''
+    def __init__(self, routes=None):
+        self.policies = {}
+        if routes is not None:
+            for route in iter_routes(routes):
+                self.policies[route.handler] = compile_policy(route.handler)
 
+    def policy(self, handler):
+        try:
+            return self.policies[handler]
+        except KeyError:
+            policy = self.policies[handler] = compile_policy(handler)
+            return policy
+
+    def on_request(self, route: Route, user: DeferredUser):
+        policy = self.policy(route.handler)
+        if policy is not None:
+            self.check(policy, user.get())
+
+    def check(self, policy, user):
         if not user:
             raise Unauthorized(dict(error='no authenticated user found'))
 
         # If there is no authorized role specified, we're done.
-        if not hasattr(handler, 'authorized_role'):
+        if policy.mask is None:
             return
 
-        required_role = handler.authorized_role
-
-        if user.role != required_role:
+        if not permissions.role_mask(user.role) & policy.mask:
             msg = 'invalid user role "{}" (expected: "{}")'
-            error = msg.format(user.role.name, required_role.name)
+            error = msg.format(user.role.name, ', '.join(policy.names))
             raise Unauthorized(dict(error=error))
 
         # Finally, the request is authorized!
@@ -0,0 +1,237 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import metrics
+from .models import Token, User, UserSession
+
+
+class LRUCache:
+    '''Thread-safe, bounded LRU cache with a time-to-live per entry.
+
+    A cache with `maxsize=0` is disabled: it stores nothing and every lookup
+    is a miss (which is not counted in the statistics).
+
+    '''
+    def __init__(self, maxsize=0, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = self._empty_stats()
+
+    @staticmethod
+    def _empty_stats():
+        return {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    def configure(self, maxsize, ttl=60):
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._entries.clear()
+            self._stats = self._empty_stats()
+
+    def get(self, key):
+        if not self.maxsize:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+
+            expires, value = entry
+            if expires <= now:
+                del self._entries[key]
+                self._stats['misses'] += 1
+                self._stats['evictions'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def set(self, key, value):
+        if not self.maxsize:
+            return
+
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def invalidate_where(self, predicate):
+        '''Remove all entries for which `predicate(key, value)` is true.'''
+        with self._lock:
+            keys = [key for key, (_, value) in self._entries.items()
+                    if predicate(key, value)]
+            for key in keys:
+                del self._entries[key]
+            self._stats['invalidations'] += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._stats['invalidations'] += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['maxsize'] = self.maxsize
+        return stats
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Session id -> (user snapshot, session updated timestamp). The cache is
+# disabled by default, see `enable_session_cache()`.
+session_cache = LRUCache()
+
+
+def enable_session_cache(maxsize=10000, ttl=60):
+    session_cache.configure(maxsize, ttl)
+
+
+def disable_session_cache():
+    session_cache.configure(0)
+
+
+# Token id -> (user snapshot, token expires, token last used). Kept separate
+# from the session cache so that high-volume API clients get their own size
+# and TTL limits.
+token_cache = LRUCache()
+
+
+def enable_token_cache(maxsize=10000, ttl=60):
+    token_cache.configure(maxsize, ttl)
+
+
+def disable_token_cache():
+    token_cache.configure(0)
+
+
+def _stats(key):
+    return lambda: {('session',): session_cache.stats()[key],
+                    ('token',): token_cache.stats()[key]}
+
+
+def _hit_ratios():
+    ratios = {}
+    for name, cache in (('session', session_cache), ('token', token_cache)):
+        stats = cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        ratios[(name,)] = stats['hits'] / lookups if lookups else 0.0
+    return ratios
+
+
+metrics.CallbackMetric(
+    'apistar_auth_cache_hits_total', 'Cache hits.', 'counter', ['cache'],
+    _stats('hits'))
+metrics.CallbackMetric(
+    'apistar_auth_cache_misses_total', 'Cache misses.', 'counter', ['cache'],
+    _stats('misses'))
+metrics.CallbackMetric(
+    'apistar_auth_cache_hit_ratio',
+    'Cache hits per lookup since the cache was configured.', 'gauge',
+    ['cache'], _hit_ratios)
+
+
+def invalidate_token(token_id):
+    '''Drop a token from the cache, e.g. when it is revoked.'''
+    if not isinstance(token_id, uuid.UUID):
+        token_id = uuid.UUID(token_id)
+    token_cache.invalidate(token_id)
+
+
+def invalidate_session(session_id):
+    '''Drop a session from the cache, e.g. when the user logs out.'''
+    if not isinstance(session_id, uuid.UUID):
+        session_id = uuid.UUID(session_id)
+    session_cache.invalidate(session_id)
+
+
+def invalidate_user(user_id):
+    '''Drop all cached sessions and tokens of a user, e.g. when their role
+    changes.'''
+    session_cache.invalidate_where(
+        lambda key, value: value[0]['id'] == user_id)
+    token_cache.invalidate_where(
+        lambda key, value: value[0]['id'] == user_id)
+
+
+def invalidate_expired_sessions(expiration_date):
+    session_cache.invalidate_where(
+        lambda key, value: value[1] <= expiration_date)
+
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, target):
+    invalidate_user(target.id)
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    invalidate_user(target.id)
+
+
+@event.listens_for(UserSession, 'after_delete')
+def _user_session_deleted(mapper, connection, target):
+    invalidate_session(target.id)
+
+
+@event.listens_for(Token, 'after_update')
+def _token_updated(mapper, connection, target):
+    invalidate_token(target.id)
+
+
+@event.listens_for(Token, 'after_delete')
+def _token_deleted(mapper, connection, target):
+    invalidate_token(target.id)
+
+
+def _column_name(key):
+    return getattr(key, 'key', key)
+
+
+@event.listens_for(Session, 'after_bulk_update')
+def _bulk_updated(update_context):
+    # Bulk updates do not tell which rows changed, so drop everything that
+    # might depend on them.
+    if update_context.mapper.class_ is User:
+        session_cache.clear()
+        token_cache.clear()
+    elif update_context.mapper.class_ is Token:
+        # Updates of 'last_used' are written by the token cache itself.
+        if set(map(_column_name, update_context.values)) != {'last_used'}:
+            token_cache.clear()
+
+
+@event.listens_for(Session, 'after_bulk_delete')
+def _bulk_deleted(delete_context):
+    if delete_context.mapper.class_ is User:
+        session_cache.clear()
+        token_cache.clear()
+    elif delete_context.mapper.class_ is Token:
+        token_cache.clear()
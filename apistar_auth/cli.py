@@ -0,0 +1,262 @@
+'''Bulk import and export of users.
+
+    python -m apistar_auth --db URL import users.csv
+    python -m apistar_auth --db URL --format jsonl export users.jsonl
+
+Files are read and written as a stream, so their size is not limited by
+memory. Imported records have the fields `username`, `password`, `role` and
+`fullname`; other fields, such as the `id`, `created` and `updated` fields
+of an export, are ignored. Passwords must be hashes in a scheme that the
+password hasher recognises, unless `--plaintext` is given. Hashes in a
+deprecated scheme are upgraded on the user's next login.
+
+'''
+import argparse
+import csv
+from contextlib import contextmanager
+import itertools
+import json
+import os
+import sys
+import time
+
+from apistar_sqlalchemy import database
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from . import hasher
+from .models import User, UserRole
+from .storage import enable_compact_storage
+
+EXPORT_FIELDS = ['id', 'username', 'password', 'role', 'fullname',
+                 'created', 'updated']
+
+
+class InvalidRecord(Exception):
+    pass
+
+
+def read_records(stream, format):
+    '''Yield the records of a CSV or JSONL stream. Lines that are not valid
+    JSON are yielded as an InvalidRecord, so that the import can report them
+    and continue.'''
+    if format == 'csv':
+        for record in csv.DictReader(stream):
+            yield record
+        return
+
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield InvalidRecord('invalid JSON')
+
+
+def write_records(stream, format, records):
+    if format == 'csv':
+        writer = csv.DictWriter(stream, EXPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+        return
+
+    for record in records:
+        stream.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+
+def prepare(record, plaintext):
+    '''Turn an input record into a row of the users table.'''
+    if isinstance(record, InvalidRecord):
+        raise record
+    if not isinstance(record, dict):
+        raise InvalidRecord('expected an object')
+
+    try:
+        row = {key: record[key] for key in ('username', 'password')}
+    except KeyError as exc:
+        raise InvalidRecord('missing field {}'.format(exc))
+
+    for key in ('username', 'password', 'role', 'fullname'):
+        value = record.get(key)
+        if value is not None and not isinstance(value, str):
+            raise InvalidRecord('field {!r} must be a string'.format(key))
+
+    try:
+        row['role'] = UserRole[record.get('role') or 'user']
+    except KeyError:
+        raise InvalidRecord('invalid role {!r}'.format(record['role']))
+
+    row['fullname'] = record.get('fullname') or None
+
+    if not row['username'] or not row['password']:
+        raise InvalidRecord('empty username or password')
+    if not plaintext and hasher.hasher().identify(row['password']) is None:
+        raise InvalidRecord('unrecognised password hash')
+    return row
+
+
+def import_batch(session, rows, plaintext):
+    '''Insert a batch of rows with executemany, skipping usernames that
+    already exist. Returns the number of inserted rows.'''
+    usernames = {}
+    for row in rows:
+        usernames.setdefault(row['username'], row)
+
+    existing = set()
+    names = list(usernames)
+    for i in range(0, len(names), 500):
+        query = session.query(User.username) \
+            .filter(User.username.in_(names[i:i + 500]))
+        existing.update(username for username, in query)
+
+    rows = [row for username, row in usernames.items()
+            if username not in existing]
+    if plaintext:
+        hashes = hasher.encrypt_many([row['password'] for row in rows])
+        for row, password in zip(rows, hashes):
+            row['password'] = password
+
+    if rows:
+        session.execute(User.__table__.insert(), rows)
+    return len(rows)
+
+
+def import_users(session, stream, format='csv', batch_size=10000,
+                 plaintext=False, errors=None):
+    '''Import users from a CSV or JSONL stream, committing every
+    `batch_size` records.
+
+    Usernames that already exist are skipped. Invalid records are skipped
+    as well and reported to the `errors` stream, if given. Returns a dict
+    with the number of imported, skipped and invalid records.
+
+    '''
+    counts = {'imported': 0, 'skipped': 0, 'invalid': 0}
+    records = enumerate(read_records(stream, format), 1)
+
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return counts
+
+        rows = []
+        for line, record in batch:
+            try:
+                rows.append(prepare(record, plaintext))
+            except InvalidRecord as exc:
+                counts['invalid'] += 1
+                if errors is not None:
+                    errors.write('record {}: {}\n'.format(line, exc))
+
+        imported = import_batch(session, rows, plaintext)
+        session.commit()
+        counts['imported'] += imported
+        counts['skipped'] += len(rows) - imported
+
+
+def export_users(session, stream, format='csv', batch_size=10000):
+    '''Write all users to a CSV or JSONL stream, ordered by id. Returns the
+    number of exported users.'''
+    columns = [getattr(User, key) for key in EXPORT_FIELDS]
+    rows = session.query(*columns).order_by(User.id).yield_per(batch_size)
+    count = 0
+
+    def records():
+        nonlocal count
+        for row in rows:
+            record = dict(zip(EXPORT_FIELDS, row))
+            record['role'] = record['role'].name
+            for key in ('created', 'updated'):
+                if record[key] is not None:
+                    record[key] = record[key].isoformat()
+            count += 1
+            yield record
+
+    write_records(stream, format, records())
+    return count
+
+
+@contextmanager
+def open_file(path, mode):
+    if path == '-':
+        # Standard streams are left open.
+        yield sys.stdin if mode == 'r' else sys.stdout
+        return
+
+    with open(path, mode, newline='', encoding='utf-8') as stream:
+        yield stream
+
+
+def guess_format(path, format):
+    if format is not None:
+        return format
+    if path.endswith('.jsonl') or path.endswith('.ndjson'):
+        return 'jsonl'
+    return 'csv'
+
+
+def report(action, count, started, stream):
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed > 0 else 0
+    stream.write('{} {} users in {:.1f}s ({:.0f} users/s)\n'.format(
+        action, count, elapsed, rate))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='apistar_auth', description='Bulk import and export of users.')
+    parser.add_argument('--db', default=os.getenv('DATABASE_URL'),
+                        help='SQLAlchemy database URL '
+                        '(default: $DATABASE_URL)')
+    parser.add_argument('--compact-storage', action='store_true',
+                        help='the database uses compact storage')
+    parser.add_argument('--format', choices=['csv', 'jsonl'],
+                        help='file format (default: by file extension)')
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='records per transaction (default: 10000)')
+
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    import_parser = commands.add_parser('import', help='import users')
+    import_parser.add_argument('file', help='input file, or - for stdin')
+    import_parser.add_argument('--plaintext', action='store_true',
+                               help='hash the passwords of the input')
+
+    export_parser = commands.add_parser('export', help='export users')
+    export_parser.add_argument('file', help='output file, or - for stdout')
+
+    args = parser.parse_args(argv)
+    if not args.db:
+        parser.error('--db or DATABASE_URL is required')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    engine = create_engine(args.db)
+    if args.compact_storage:
+        enable_compact_storage(engine)
+    database.Base.metadata.create_all(engine)
+
+    session = Session(bind=engine)
+    format = guess_format(args.file, args.format)
+    started = time.perf_counter()
+
+    try:
+        if args.command == 'import':
+            with open_file(args.file, 'r') as stream:
+                counts = import_users(session, stream, format,
+                                      args.batch_size, args.plaintext,
+                                      errors=sys.stderr)
+            report('imported', counts['imported'], started, sys.stderr)
+            sys.stderr.write('skipped {skipped} existing and {invalid} '
+                             'invalid records\n'.format(**counts))
+        else:
+            with open_file(args.file, 'w') as stream:
+                count = export_users(session, stream, format,
+                                     args.batch_size)
+            report('exported', count, started, sys.stderr)
+    finally:
+        session.close()
@@ -1,10 +1,89 @@
 from http.cookies import SimpleCookie
 from datetime import datetime, timedelta
 from urllib.parse import urlparse
+import time
+import uuid
+
+from apistar import http
+from apistar.server.wsgi import WSGIEnviron
 
 
 SESSION_COOKIE_NAME = 'session_id'
 
+# Keyring to sign session cookies with. When set, session cookies carry the
+# session id, user id, role, issued-at time and session epoch, and are
+# verified without a database lookup, see `enable_signed_session_cookies()`.
+signed_cookie_keyring = None
+
+# Age after which a signed session cookie is checked against the database
+# and reissued.
+signed_cookie_refresh_after = timedelta(minutes=15)
+
+# WSGI environ key under which `UserComponent` leaves a reissued cookie.
+REFRESHED_COOKIE_KEY = 'apistar_auth.refreshed_cookie'
+
+# User id -> lowest session epoch that is still valid on this node.
+revoked_epochs = {}
+
+
+def enable_signed_session_cookies(keyring,
+                                  refresh_after=timedelta(minutes=15)):
+    global signed_cookie_keyring, signed_cookie_refresh_after
+    signed_cookie_keyring = keyring
+    signed_cookie_refresh_after = refresh_after
+
+
+def disable_signed_session_cookies():
+    global signed_cookie_keyring
+    signed_cookie_keyring = None
+    revoked_epochs.clear()
+
+
+def revoke_epoch(user_id, epoch):
+    '''Reject signed cookies of a user with an epoch below `epoch` without
+    waiting for them to be refreshed.'''
+    revoked_epochs[user_id] = max(epoch, revoked_epochs.get(user_id, 0))
+
+
+def encode_session(session_id, user):
+    if signed_cookie_keyring is None:
+        return str(session_id)
+
+    return signed_cookie_keyring.sign({
+        'typ': 'session',
+        'sid': session_id.hex,
+        'uid': user.id,
+        'role': user.role.name,
+        'iat': int(time.time()),
+        'epoch': user.session_epoch or 0,
+    })
+
+
+def decode_signed_session(value):
+    '''Return the payload of a signed session cookie, or None if signed
+    session cookies are disabled or the cookie is not validly signed.'''
+    if signed_cookie_keyring is None or '.' not in value:
+        return None
+
+    payload = signed_cookie_keyring.unsign(value)
+    if not isinstance(payload, dict) or payload.get('typ') != 'session':
+        return None
+
+    try:
+        payload['sid'] = uuid.UUID(payload['sid'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return payload
+
+
+def needs_refresh(payload):
+    age = time.time() - payload['iat']
+    return age >= signed_cookie_refresh_after.total_seconds()
+
+
+def is_revoked(payload):
+    return payload['epoch'] < revoked_epochs.get(payload['uid'], 0)
+
 
 def get_session_cookie(url: str, session_id: str) -> SimpleCookie:
     parsed = urlparse(url)
@@ -25,3 +104,34 @@ def get_session_cookie(url: str, session_id: str) -> SimpleCookie:
     cookie[SESSION_COOKIE_NAME]['expires'] = expires.strftime(date_format)
 
     return cookie
+
+
+def get_request_session_cookie(headers):
+    cookie_header = headers.get('cookie')
+    if not cookie_header:
+        return None
+
+    cookie = SimpleCookie()
+    cookie.load(cookie_header)
+
+    session_id_cookie = cookie.get(SESSION_COOKIE_NAME)
+    if not session_id_cookie:
+        return None
+
+    return session_id_cookie.value
+
+
+class SignedSessionCookieHook:
+    '''Reissue signed session cookies that are due for a refresh.
+
+    `UserComponent` checks such cookies against the database and leaves the
+    reissued cookie in the WSGI environ; this hook sends it to the client so
+    the following requests are verified locally again.
+
+    '''
+    def on_response(self, environ: WSGIEnviron, response: http.Response
+                    ) -> http.Response:
+        cookie = environ.get(REFRESHED_COOKIE_KEY)
+        if cookie is not None and 'set-cookie' not in response.headers:
+            response.headers['Set-Cookie'] = cookie
+        return response
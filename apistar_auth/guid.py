@@ -1,13 +1,16 @@
 import uuid
-from sqlalchemy.types import TypeDecorator, CHAR
+from sqlalchemy.types import TypeDecorator, BINARY, CHAR
 from sqlalchemy.dialects.postgresql import UUID
 
+from .storage import uses_compact_storage
+
 
 class GUID(TypeDecorator):
     '''Platform-independent GUID type.
 
     Uses PostgreSQL's UUID type, otherwise uses
     CHAR(32), storing as stringified hex values.
+    In compact storage mode, uses BINARY(16).
 
     '''
     impl = CHAR
@@ -15,6 +18,8 @@ class GUID(TypeDecorator):
     def load_dialect_impl(self, dialect):
         if dialect.name == 'postgresql':
             return dialect.type_descriptor(UUID())
+        if uses_compact_storage(dialect):
+            return dialect.type_descriptor(BINARY(16))
         return dialect.type_descriptor(CHAR(32))
 
     def process_bind_param(self, value, dialect):
@@ -24,6 +29,11 @@ class GUID(TypeDecorator):
         if dialect.name == 'postgresql':
             return str(value)
 
+        if uses_compact_storage(dialect):
+            if not isinstance(value, uuid.UUID):
+                value = uuid.UUID(value)
+            return value.bytes
+
         if not isinstance(value, uuid.UUID):
             return "%.32x" % uuid.UUID(value).int
         # hexstring
@@ -36,6 +46,9 @@ class GUID(TypeDecorator):
         if value is None:
             return value
 
+        if isinstance(value, bytes):
+            return uuid.UUID(bytes=value)
+
         if not isinstance(value, uuid.UUID):
             value = uuid.UUID(value)
         return value
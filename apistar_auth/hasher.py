@@ -1,23 +1,317 @@
-from passlib.hash import bcrypt_sha256, ldap_sha1
+import asyncio
+import collections
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from apistar.exceptions import HTTPException
+from passlib.context import CryptContext
+from passlib.hash import bcrypt_sha256
+
+from . import metrics
 
 
 # Number of bcrypt rounds (default=12). During testing, bcrypt is not used
 # (see also `setup_method()` in ./testutil.py) to speed up the unit tests.
 bcrypt_rounds = 12
 
+# Password hash context, built once by `hasher()` and reset whenever the
+# hasher configuration changes.
+_context = None
+
 
 def enable_bcrypt_hasher(rounds=12):
-    global bcrypt_rounds
+    global bcrypt_rounds, _context
     bcrypt_rounds = rounds
+    _context = None
 
 
 def disable_bcrypt_hasher():
-    global bcrypt_rounds
+    global bcrypt_rounds, _context
     bcrypt_rounds = 0
+    _context = None
 
 
-def hasher():
-    if bcrypt_rounds:
-        return bcrypt_sha256.using(rounds=bcrypt_rounds)
+# Result of the last bcrypt cost calibration, see `calibrate_bcrypt_hasher()`.
+calibration = None
+
+
+def measure_bcrypt_rounds(rounds, samples=3):
+    '''Return the fastest verify time (in seconds) of a bcrypt_sha256 hash
+    with the given number of rounds on this host.'''
+    handler = bcrypt_sha256.using(rounds=rounds)
+    password_hash = handler.hash('calibration')
+
+    best = None
+    for _ in range(samples):
+        started = time.perf_counter()
+        handler.verify('calibration', password_hash)
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def calibrate_bcrypt_hasher(target_latency=0.1, min_rounds=4, max_rounds=16,
+                            samples=3):
+    '''Benchmark bcrypt_sha256 and enable the highest number of rounds for
+    which a password verify fits within `target_latency` seconds.
+
+    Every extra round doubles the cost, so the benchmark stops at the first
+    round count that exceeds the target. When even `min_rounds` is too slow,
+    `min_rounds` is used. The measured timings are returned and kept in
+    `calibration`.
+
+    '''
+    global calibration
+
+    timings = {}
+    rounds = min_rounds
+    for candidate in range(min_rounds, max_rounds + 1):
+        timings[candidate] = measure_bcrypt_rounds(candidate, samples)
+        if timings[candidate] > target_latency:
+            break
+        rounds = candidate
+
+    enable_bcrypt_hasher(rounds)
+    calibration = {
+        'target_latency': target_latency,
+        'rounds': rounds,
+        'timings': timings,
+    }
+    return calibration
+
+
+def set_hasher(context):
+    '''Replace the password hash context by a custom passlib CryptContext.
+
+    The context is used as-is until the hasher is reconfigured by
+    `enable_bcrypt_hasher()` or `disable_bcrypt_hasher()`.
+
+    '''
+    global _context
+    _context = context
+
+
+def build_context(rounds):
+    if rounds:
+        # Hashes of other schemes or with a different number of rounds are
+        # still verified, but flagged for an update on the next login.
+        return CryptContext(
+            schemes=['bcrypt_sha256', 'ldap_sha1'],
+            default='bcrypt_sha256',
+            deprecated=['ldap_sha1'],
+            bcrypt_sha256__default_rounds=rounds,
+            bcrypt_sha256__min_rounds=rounds,
+            bcrypt_sha256__max_rounds=rounds,
+        )
+
     # During testing, a weaker password hasher is used.
-    return ldap_sha1
+    return CryptContext(schemes=['ldap_sha1', 'bcrypt_sha256'],
+                        default='ldap_sha1')
+
+
+def hasher():
+    global _context
+    context = _context
+    if context is None:
+        context = _context = build_context(bcrypt_rounds)
+    return context
+
+
+class HasherBusy(HTTPException):
+    default_status_code = 503
+    default_detail = 'Service Unavailable'
+
+
+class HashingExecutor:
+    '''Bounded worker pool for password hashing and verification.
+
+    At most `max_workers` hashes run concurrently and at most `max_queue`
+    hashes wait for a worker. Any further request is rejected with a 503
+    instead of piling up work, so a burst of logins cannot starve the other
+    endpoints. With `max_workers=0`, hashes run inline on the caller thread.
+
+    '''
+    def __init__(self, max_workers=None, max_queue=None):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_queue is None:
+            max_queue = 4 * max_workers
+
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = self._empty_stats()
+
+    @staticmethod
+    def _empty_stats():
+        return {
+            'calls': 0,
+            'rejected': 0,
+            'queue_wait': 0.0,
+            'hash_time': 0.0,
+        }
+
+    def _submit(self, fn, args):
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self._stats['rejected'] += 1
+                raise HasherBusy(dict(error='password hasher is busy'))
+            self._pending += 1
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.max_workers)
+            pool = self._pool
+
+        try:
+            return pool.submit(self._timed, fn, args, time.perf_counter())
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+
+    def run(self, fn, *args):
+        if not self.max_workers:
+            return self._timed(fn, args, time.perf_counter())
+        return self._submit(fn, args).result()
+
+    def run_async(self, fn, *args):
+        '''Like `run()`, but return an awaitable instead of blocking the
+        calling thread, for use from an event loop.'''
+        if not self.max_workers:
+            future = asyncio.get_event_loop().create_future()
+            try:
+                future.set_result(self._timed(fn, args, time.perf_counter()))
+            except Exception as exc:  # pylint: disable=broad-except
+                future.set_exception(exc)
+            return future
+        return asyncio.wrap_future(self._submit(fn, args))
+
+    def map(self, fn, items):
+        '''Run `fn` for each item on the worker pool and return the results
+        in order.
+
+        Meant for bulk work: items are never rejected, and at most
+        `max_workers` of them are submitted at a time, so that single hashes
+        from `run()` still get a place in the queue.
+
+        '''
+        if not self.max_workers:
+            return [self._timed(fn, (item,), time.perf_counter())
+                    for item in items]
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.max_workers)
+            pool = self._pool
+
+        results = []
+        window = collections.deque()
+        try:
+            for item in items:
+                if len(window) >= self.max_workers:
+                    results.append(window.popleft().result())
+                with self._lock:
+                    self._pending += 1
+                try:
+                    window.append(pool.submit(self._timed, fn, (item,),
+                                              time.perf_counter()))
+                except BaseException:
+                    with self._lock:
+                        self._pending -= 1
+                    raise
+            while window:
+                results.append(window.popleft().result())
+        finally:
+            # Cancelled hashes never reach `_timed()` to release their slot.
+            for future in window:
+                if future.cancel():
+                    with self._lock:
+                        self._pending -= 1
+        return results
+
+    def _timed(self, fn, args, queued):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                if self.max_workers:
+                    self._pending -= 1
+                self._stats['calls'] += 1
+                self._stats['queue_wait'] += started - queued
+                self._stats['hash_time'] += finished - started
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = self._pending
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = self._empty_stats()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+
+executor = HashingExecutor()
+
+
+def configure_hashing_executor(max_workers=None, max_queue=None):
+    global executor
+    executor.shutdown(wait=False)
+    executor = HashingExecutor(max_workers, max_queue)
+    return executor
+
+
+def _run(operation, fn, *args):
+    # Runs a single hash on the executor and records its latency.
+    started = time.perf_counter()
+    result = executor.run(fn, *args)
+    metrics.hash_seconds.observe(time.perf_counter() - started, operation)
+    return result
+
+
+def encrypt(password):
+    return _run('encrypt', hasher().hash, password)
+
+
+def encrypt_many(passwords):
+    '''Hash a batch of passwords on all workers of the executor.'''
+    return executor.map(hasher().hash, passwords)
+
+
+def verify_and_update_async(password, password_hash):
+    '''Awaitable version of `verify_and_update()`.'''
+    started = time.perf_counter()
+    future = executor.run_async(hasher().verify_and_update, password,
+                                password_hash)
+    future.add_done_callback(lambda _: metrics.hash_seconds.observe(
+        time.perf_counter() - started, 'verify'))
+    return future
+
+
+def verify(password, password_hash):
+    return _run('verify', hasher().verify, password, password_hash)
+
+
+def verify_and_update(password, password_hash):
+    '''Verify a password and rehash it if its hash is outdated.
+
+    Returns a `(verified, new_hash)` tuple. `new_hash` is None unless the
+    password is valid and its hash uses a deprecated scheme or a different
+    number of rounds than currently configured.
+
+    '''
+    return _run('verify', hasher().verify_and_update, password,
+                password_hash)
@@ -2,8 +2,11 @@ from apistar import Route, validators, types, http
 from apistar.exceptions import BadRequest
 from sqlalchemy.orm import Session
 
-from .users import User, UserType, UserSession, prune_expired_sessions
-from .cookies import get_session_cookie
+from . import metrics
+from . import replica
+from .users import attach_user, serialize_user, User, UserType
+from .cookies import encode_session, get_session_cookie
+from .stores import get_session_store
 
 
 class LoginType(types.Type):
@@ -13,23 +16,28 @@ class LoginType(types.Type):
 
 def login(session: Session, request: http.Request,
           data: LoginType) -> UserType:
-    user = session.query(User).filter(User.username == data.username).first()
+    user = replica.read(session, lambda s: s.query(User)
+                        .filter(User.username == data.username).first())
+    user = attach_user(session, user)
     if not user:
+        metrics.logins.inc('failure')
         raise BadRequest(dict(error='Invalid username/password'))
 
-    verified = user.verify_password(data.password)
+    # Passwords hashed with an outdated scheme or cost are rehashed here.
+    verified = user.verify_and_update_password(data.password)
     if not verified:
+        metrics.logins.inc('failure')
         raise BadRequest(dict(error='Invalid username/password'))
 
-    user_session = UserSession(user=user)
-    session.add(user_session)
+    metrics.logins.inc('success')
 
-    cookie = get_session_cookie(request.url, str(user_session.id))
-    headers = {'Set-Cookie': cookie.output(header='')}
+    session_id = get_session_store().create(session, user)
 
-    prune_expired_sessions(session)
+    cookie = get_session_cookie(request.url,
+                                encode_session(session_id, user))
+    headers = {'Set-Cookie': cookie.output(header='')}
 
-    return http.JSONResponse(UserType(user), headers=headers)
+    return http.JSONResponse(serialize_user(user), headers=headers)
 
 
 routes = [
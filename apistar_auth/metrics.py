@@ -0,0 +1,267 @@
+'''Counters and latency histograms for the hot paths of authentication.
+
+Metrics are available from Python with `snapshot()`, and in the Prometheus
+text format from the `/auth/metrics` route:
+
+    app = App(routes=routes + metrics_routes, ...)
+
+The route is not part of `apistar_auth.routes` and is not authorized, so
+that it can be scraped; only add it where the metrics may be read.
+
+Every thread updates its own copy of a metric without taking a lock. The
+copies are added up when the metrics are collected, so recording a value
+costs a few dict operations and metrics can be left on in production.
+
+'''
+from bisect import bisect_left
+import threading
+
+from apistar import Route, http
+
+# Upper bounds in seconds of the latency histogram buckets.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# When False, `Counter.inc()` and `Histogram.observe()` do nothing. See
+# `disable_metrics()`.
+enabled = True
+
+# All metrics, in the order in which they are rendered.
+registry = []
+
+
+class PrometheusResponse(http.Response):
+    media_type = 'text/plain; version=0.0.4'
+
+
+class Metric:
+    '''Base class of metrics that are aggregated per thread.
+
+    Values are kept per tuple of label values, in a dict of the thread that
+    recorded them. The dicts of finished threads are folded into a single
+    one on collection.
+
+    '''
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = {}
+        registry.append(self)
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _merge(self, total, values):
+        raise NotImplementedError()
+
+    def values(self):
+        '''Return the value of each set of label values, summed over all
+        threads.'''
+        with self._lock:
+            shards = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    shards.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard)
+            self._shards = shards
+
+            total = {}
+            self._merge(total, self._retired)
+            for _, shard in shards:
+                # Copying a dict does not release the GIL, so the owning
+                # thread cannot change it meanwhile.
+                self._merge(total, shard.copy())
+        return total
+
+    def reset(self):
+        with self._lock:
+            self._retired = {}
+            for _, shard in self._shards:
+                shard.clear()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        if not enabled:
+            return
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, total, values):
+        for labels, value in values.items():
+            total[labels] = total.get(labels, 0) + value
+
+
+class Histogram(Metric):
+    '''A histogram of observed values.
+
+    Its values are dicts with the cumulative count per bucket upper bound,
+    the total `count` and the `sum` of all observations.
+
+    '''
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        if not enabled:
+            return
+        shard = self._shard()
+        cell = shard.get(labels)
+        if cell is None:
+            # A count per bucket, one for +Inf, and the sum.
+            cell = shard[labels] = [0] * (len(self.buckets) + 2)
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def _merge(self, total, values):
+        for labels, cell in values.items():
+            cell = list(cell)
+            merged = total.get(labels)
+            if merged is None:
+                total[labels] = cell
+            else:
+                for i, value in enumerate(cell):
+                    merged[i] += value
+
+    def values(self):
+        values = {}
+        for labels, cell in super().values().items():
+            buckets = []
+            count = 0
+            for bound, value in zip(self.buckets + (float('inf'),), cell):
+                count += value
+                buckets.append((bound, count))
+            values[labels] = {'buckets': buckets, 'count': count,
+                              'sum': cell[-1]}
+        return values
+
+
+class CallbackMetric:
+    '''A metric whose values are computed on collection by `callback`,
+    which returns a dict like `Metric.values()`.'''
+    def __init__(self, name, help, type, labelnames, callback):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        registry.append(self)
+
+    def values(self):
+        return self.callback()
+
+    def reset(self):
+        pass
+
+
+resolve_seconds = Histogram(
+    'apistar_auth_resolve_seconds',
+    'Time to resolve the user of a request, by credential type.',
+    ['method'])
+hash_seconds = Histogram(
+    'apistar_auth_password_hash_seconds',
+    'Time to hash or verify a password, including the wait for a worker.',
+    ['operation'])
+logins = Counter(
+    'apistar_auth_logins_total', 'Login attempts, by result.', ['result'])
+touches = Counter(
+    'apistar_auth_touches_total',
+    'Updates of the last use of sessions and tokens.', ['kind'])
+pruned = Counter(
+    'apistar_auth_pruned_total',
+    'Expired sessions and tokens deleted by pruning.', ['kind'])
+
+
+def enable_metrics():
+    global enabled
+    enabled = True
+
+
+def disable_metrics():
+    global enabled
+    enabled = False
+
+
+def reset_metrics():
+    '''Set all counters and histograms back to zero.'''
+    for metric in registry:
+        metric.reset()
+
+
+def snapshot():
+    '''Return the current value of every metric, by metric name and tuple
+    of label values.'''
+    return {metric.name: metric.values() for metric in registry}
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value)
+
+
+def render():
+    '''Return all metrics in the Prometheus text exposition format.'''
+    lines = []
+    for metric in registry:
+        lines.append('# HELP {} {}'.format(metric.name, metric.help))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+
+        for labels, value in sorted(metric.values().items()):
+            if metric.type != 'histogram':
+                lines.append('{}{} {}'.format(
+                    metric.name, _labels(metric.labelnames, labels),
+                    _number(value)))
+                continue
+
+            for bound, count in value['buckets']:
+                lines.append('{}_bucket{} {}'.format(
+                    metric.name,
+                    _labels(metric.labelnames, labels, ('le', _number(bound))),
+                    count))
+            suffix = _labels(metric.labelnames, labels)
+            lines.append('{}_sum{} {}'.format(metric.name, suffix,
+                                              _number(value['sum'])))
+            lines.append('{}_count{} {}'.format(metric.name, suffix,
+                                                value['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def get_metrics() -> http.Response:
+    return PrometheusResponse(render())
+
+
+routes = [
+    Route('/auth/metrics', 'GET', get_metrics),
+]
@@ -1,25 +1,39 @@
 import enum
 import uuid
 import secrets
-from datetime import datetime, timezone
+from datetime import timezone
 
 from apistar_sqlalchemy import database
-from sqlalchemy import Column, String, Integer, ForeignKey, types
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, types
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql.functions import now
 from sqlalchemy_utils.types.choice import ChoiceType
 
 from .guid import GUID
-from .hasher import hasher
+from .storage import EPOCH, MICROSECOND, utc_now, uses_compact_storage
+from . import hasher
 
 
 class DateTimeUTC(types.TypeDecorator):
+    '''Timezone-aware UTC timestamp.
+
+    In compact storage mode, timestamps are stored as integer microseconds
+    since the epoch.
+
+    '''
     impl = types.DateTime
 
+    def load_dialect_impl(self, dialect):
+        if uses_compact_storage(dialect):
+            return dialect.type_descriptor(types.BigInteger())
+        return dialect.type_descriptor(self.impl)
+
     def process_bind_param(self, value, dialect):
         if value is None:
             return None
-        return value.astimezone(timezone.utc)
+        value = value.astimezone(timezone.utc)
+        if uses_compact_storage(dialect):
+            return (value - EPOCH) // MICROSECOND
+        return value
 
     def process_literal_param(self, value, dialect):
         raise NotImplementedError()
@@ -27,9 +41,9 @@ class DateTimeUTC(types.TypeDecorator):
     def process_result_value(self, value, dialect):
         if value is None:
             return None
-        return datetime(value.year, value.month, value.day,
-                        value.hour, value.minute, value.second,
-                        value.microsecond, tzinfo=timezone.utc)
+        if uses_compact_storage(dialect):
+            return EPOCH + MICROSECOND * value
+        return value.replace(tzinfo=timezone.utc)
 
 
 class UserRole(enum.Enum):
@@ -60,9 +74,13 @@ class User(database.Base):
     role = Column(ChoiceType(UserRole, impl=Integer()), nullable=False)
     fullname = Column(String)
 
-    created = Column(DateTimeUTC(timezone=True), server_default=now())
-    updated = Column(DateTimeUTC(timezone=True), server_default=now(),
-                     onupdate=now())
+    # Signed session cookies with an older epoch are rejected.
+    session_epoch = Column(Integer, nullable=False, default=0,
+                           server_default='0')
+
+    created = Column(DateTimeUTC(timezone=True), server_default=utc_now())
+    updated = Column(DateTimeUTC(timezone=True), server_default=utc_now(),
+                     onupdate=utc_now())
 
     sessions = relationship('UserSession',  # order_by='user_sessions.created',
                             back_populates='user')
@@ -71,10 +89,16 @@ class User(database.Base):
         # Convert role name to enum value.
         kwargs['role'] = UserRole[kwargs['role']]
         super().__init__(*args, **kwargs)
-        self.password = hasher().encrypt(self.password)
+        self.password = hasher.encrypt(self.password)
 
     def verify_password(self, password):
-        return hasher().verify(password, self.password)
+        return hasher.verify(password, self.password)
+
+    def verify_and_update_password(self, password):
+        verified, new_hash = hasher.verify_and_update(password, self.password)
+        if new_hash is not None:
+            self.password = new_hash
+        return verified
 
     def __repr__(self):
         msg = '<User(username=%r, role=%s, fullname=%r)>'
@@ -87,12 +111,17 @@ class UserSession(database.Base):
     id = Column(GUID, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
 
-    created = Column(DateTimeUTC(timezone=True), server_default=now())
-    updated = Column(DateTimeUTC(timezone=True), server_default=now(),
-                     onupdate=now(), index=True)
+    created = Column(DateTimeUTC(timezone=True), server_default=utc_now())
+    updated = Column(DateTimeUTC(timezone=True), server_default=utc_now(),
+                     onupdate=utc_now(), index=True)
 
     user = relationship('User', back_populates='sessions')
 
+    # Sessions are listed per user, most recently used first.
+    __table_args__ = (
+        Index('ix_user_sessions_user_id_updated', user_id, updated),
+    )
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.id = self.generate_session_id()
@@ -111,12 +140,20 @@ class Token(database.Base):
     id = Column(GUID, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
 
-    created = Column(DateTimeUTC(timezone=True), server_default=now())
-    updated = Column(DateTimeUTC(timezone=True), server_default=now(),
-                     onupdate=now(), index=True)
+    created = Column(DateTimeUTC(timezone=True), server_default=utc_now())
+    updated = Column(DateTimeUTC(timezone=True), server_default=utc_now(),
+                     onupdate=utc_now(), index=True)
+
+    # Tokens without expiration date are valid until they are deleted.
+    expires = Column(DateTimeUTC(timezone=True), index=True)
+    last_used = Column(DateTimeUTC(timezone=True))
 
     user = relationship('User')
 
+    __table_args__ = (
+        Index('ix_tokens_user_id_updated', user_id, updated),
+    )
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.id = self.generate_session_id()
@@ -0,0 +1,147 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from apistar import http
+from apistar.exceptions import BadRequest
+from sqlalchemy import and_, or_
+
+from .storage import EPOCH, MICROSECOND
+
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+# Largest page that a client can request with the `limit` query parameter.
+max_page_size = 1000
+
+# Number of rows fetched from the database at a time while listing.
+fetch_size = 500
+
+
+class NDJSONResponse(http.Response):
+    media_type = NDJSON_MEDIA_TYPE
+    charset = None
+
+
+def encode_cursor(values):
+    '''Encode the keyset of the last row of a page as an opaque cursor.'''
+    encoded = []
+    for value in values:
+        if isinstance(value, datetime):
+            value = (value - EPOCH) // MICROSECOND
+        elif isinstance(value, uuid.UUID):
+            value = value.hex
+        encoded.append(value)
+    data = json.dumps(encoded, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor, types):
+    '''Decode a cursor into a keyset of the given types (datetime, UUID or
+    int). Raises BadRequest for invalid cursors.'''
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        encoded = json.loads(data.decode('utf-8'))
+        if not isinstance(encoded, list) or len(encoded) != len(types):
+            raise ValueError(cursor)
+
+        values = []
+        for value, type_ in zip(encoded, types):
+            if type_ is uuid.UUID:
+                if not isinstance(value, str):
+                    raise ValueError(value)
+                value = uuid.UUID(value)
+            elif not isinstance(value, int) or isinstance(value, bool):
+                raise ValueError(value)
+            elif type_ is datetime:
+                value = EPOCH + MICROSECOND * value
+            values.append(value)
+        return tuple(values)
+    except (AttributeError, OverflowError, TypeError, ValueError,
+            UnicodeDecodeError):
+        raise BadRequest({'error': 'invalid cursor'})
+
+
+def get_limit(limit):
+    if not limit:
+        return None
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise BadRequest({'error': 'limit must be an integer'})
+    if limit <= 0:
+        raise BadRequest({'error': 'limit must be positive'})
+    return min(limit, max_page_size)
+
+
+def keyset_filter(columns, values, descending=False):
+    '''Return the condition for rows after the keyset `values` in the order
+    of `columns`.'''
+    conditions = []
+    for i, (column, value) in enumerate(zip(columns, values)):
+        equal = [c == v for c, v in zip(columns[:i], values[:i])]
+        after = column < value if descending else column > value
+        conditions.append(and_(*equal, after))
+    return or_(*conditions)
+
+
+def keyset_page(query, columns, after=None, limit=None, descending=False):
+    '''Order `query` by `columns`, continue after the keyset `after` and
+    fetch at most `limit` rows in chunks of `fetch_size` rows.'''
+    if after is not None:
+        query = query.filter(keyset_filter(columns, after, descending))
+    if descending:
+        query = query.order_by(*[column.desc() for column in columns])
+    else:
+        query = query.order_by(*columns)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.yield_per(fetch_size)
+
+
+def fetch_limit(limit):
+    # Fetch one more row than requested to know whether there is a next page.
+    return None if limit is None else limit + 1
+
+
+def list_response(rows, serialize, keyset, url, limit=None, accept=None):
+    '''Serialize a page of rows as a JSON array, or as newline-delimited
+    JSON when the client accepts NDJSON.
+
+    Rows are serialized one at a time while they are fetched. If there are
+    more than `limit` rows, the `Link` header refers to the next page.
+
+    '''
+    ndjson = accept is not None and NDJSON_MEDIA_TYPE in accept
+
+    items = []
+    last = next_cursor = None
+    for i, row in enumerate(rows):
+        if limit is not None and i == limit:
+            next_cursor = encode_cursor(keyset(last))
+            break
+        item = serialize(row)
+        if ndjson:
+            item = json.dumps(item, separators=(',', ':')).encode('utf-8')
+        items.append(item)
+        last = row
+
+    headers = {}
+    if next_cursor is not None:
+        headers['Link'] = '<{}>; rel="next"'.format(
+            next_page_url(url, next_cursor, limit))
+
+    if ndjson:
+        content = b''.join(item + b'\n' for item in items)
+        return NDJSONResponse(content, headers=headers)
+    return http.JSONResponse(items, headers=headers)
+
+
+def next_page_url(url, cursor, limit):
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query)
+             if key not in ('after', 'limit')]
+    query += [('limit', str(limit)), ('after', cursor)]
+    return urlunsplit(parts._replace(query=urlencode(query)))
@@ -0,0 +1,72 @@
+from .models import UserRole
+
+
+# Named permissions of each role. Deployments can replace this table with
+# `load_permissions()` before the AuthorizationHook is created.
+default_role_permissions = {
+    UserRole.admin: set(),
+    UserRole.user: set(),
+}
+
+# Bit assigned to each role and each named permission.
+role_bits = {}
+permission_bits = {}
+
+# Role -> bitmask of the role itself and all of its permissions.
+role_masks = {}
+
+
+def load_permissions(role_permissions=None):
+    '''Compile a role -> permissions table into bitmasks.
+
+    Every role and every named permission gets its own bit. Authorization
+    then needs a single bitwise AND of the user's role mask and the mask
+    required by the route.
+
+    '''
+    global role_bits, permission_bits, role_masks
+
+    if role_permissions is None:
+        role_permissions = default_role_permissions
+
+    names = set()
+    for permissions in role_permissions.values():
+        names.update(permissions)
+
+    new_role_bits = {role: 1 << i for i, role in enumerate(UserRole)}
+    new_permission_bits = {
+        name: 1 << (len(new_role_bits) + i)
+        for i, name in enumerate(sorted(names))
+    }
+
+    new_role_masks = {}
+    for role, bit in new_role_bits.items():
+        mask = bit
+        for name in role_permissions.get(role, ()):
+            mask |= new_permission_bits[name]
+        new_role_masks[role] = mask
+
+    role_bits = new_role_bits
+    permission_bits = new_permission_bits
+    role_masks = new_role_masks
+
+
+def role_mask(role):
+    return role_masks.get(role, 0)
+
+
+def required_mask(roles=(), permissions=()):
+    '''Return the bitmask that accepts any of the given roles or permissions.
+
+    Raises a KeyError for unknown permissions.
+
+    '''
+    mask = 0
+    for role in roles:
+        mask |= role_bits[role]
+    for name in permissions:
+        mask |= permission_bits[name]
+    return mask
+
+
+load_permissions()
@@ -0,0 +1,187 @@
+'''Per-request SQL profiling.
+
+Counts the statements that SQLAlchemy sends to the database, and the time
+they take, per request and per block of code:
+
+    app = App(..., event_hooks=[QueryProfilingHook(), ...])
+    enable_query_profiling()
+
+Responses then carry a `Server-Timing` header with the database time and
+number of statements of the request, e.g.
+`Server-Timing: db;dur=1.52;desc="3 queries"`. Put the hook first, so that
+the statements of the other hooks are included.
+
+Tests can put a budget on the statements of a block, which catches N+1
+queries and extra savepoints before they ship:
+
+    with query_budget(2):
+        client.get('/users/sessions')
+
+Statements are attributed to the thread that runs them, so request
+profiles are only correct for WSGI apps, which handle a request per thread.
+
+'''
+from contextlib import contextmanager
+import threading
+import time
+
+from apistar import http
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SAVEPOINT_PREFIXES = ('SAVEPOINT ', 'RELEASE SAVEPOINT ',
+                      'ROLLBACK TO SAVEPOINT ')
+
+# When True, `QueryProfilingHook` profiles requests and adds the
+# `Server-Timing` header, see `enable_query_profiling()`.
+query_profiling = False
+
+# Called with `(statement, parameters, duration)` after every statement, see
+# `enable_query_log()`.
+query_log = None
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryProfile:
+    '''Statements run within a request or a `profile_queries()` block.
+
+    `count` includes savepoint statements, which are also counted
+    separately in `savepoints`. `duration` is in seconds.
+
+    '''
+    def __init__(self):
+        self.count = 0
+        self.savepoints = 0
+        self.duration = 0.0
+        self.statements = []
+
+    def add(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        if statement.startswith(SAVEPOINT_PREFIXES):
+            self.savepoints += 1
+        self.statements.append(statement)
+
+    def server_timing(self):
+        return 'db;dur={:.2f};desc="{} queries"'.format(
+            self.duration * 1e3, self.count)
+
+
+def _active_profiles():
+    profiles = list(getattr(_local, 'blocks', ()))
+    request = getattr(_local, 'request', None)
+    if request is not None:
+        profiles.append(request)
+    return profiles
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    # Statements do not nest within a thread, so a single start time per
+    # thread is enough.
+    _local.started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    started = getattr(_local, 'started', None)
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    _local.started = None
+
+    for profile in _active_profiles():
+        profile.add(statement, duration)
+    if query_log is not None:
+        query_log(statement, parameters, duration)
+
+
+def _listen():
+    # Listens to all engines, so that profiles include every database of
+    # the application.
+    for name, fn in (('before_cursor_execute', _before_cursor_execute),
+                     ('after_cursor_execute', _after_cursor_execute)):
+        if not event.contains(Engine, name, fn):
+            event.listen(Engine, name, fn)
+
+
+def enable_query_profiling():
+    global query_profiling
+    _listen()
+    query_profiling = True
+
+
+def disable_query_profiling():
+    global query_profiling
+    query_profiling = False
+
+
+def enable_query_log(callback):
+    '''Call `callback(statement, parameters, duration)` after every
+    statement, e.g. to print the statements of a test.'''
+    global query_log
+    _listen()
+    query_log = callback
+
+
+def disable_query_log():
+    global query_log
+    query_log = None
+
+
+@contextmanager
+def profile_queries():
+    '''Profile the statements that the current thread runs within the
+    block.'''
+    _listen()
+    profile = QueryProfile()
+    blocks = getattr(_local, 'blocks', None)
+    if blocks is None:
+        blocks = _local.blocks = []
+    blocks.append(profile)
+    try:
+        yield profile
+    finally:
+        blocks.remove(profile)
+
+
+@contextmanager
+def query_budget(count, savepoints=None):
+    '''Raise QueryBudgetExceeded if the block runs more than `count`
+    statements, or more than `savepoints` savepoint statements if given.'''
+    with profile_queries() as profile:
+        yield profile
+
+    if profile.count > count or \
+            savepoints is not None and profile.savepoints > savepoints:
+        raise QueryBudgetExceeded(
+            'ran {} statements ({} savepoint statements), budget is {} '
+            '({}):\n{}'.format(profile.count, profile.savepoints, count,
+                               savepoints, '\n'.join(profile.statements)))
+
+
+class QueryProfilingHook:
+    '''Profile the statements of each request while query profiling is
+    enabled, and report them in a `Server-Timing` header.'''
+    def on_request(self):
+        _local.request = QueryProfile() if query_profiling else None
+
+    def on_response(self, response: http.Response) -> http.Response:
+        profile = getattr(_local, 'request', None)
+        _local.request = None
+        if profile is None:
+            return response
+
+        timing = response.headers.get('Server-Timing')
+        response.headers['Server-Timing'] = profile.server_timing() \
+            if not timing else timing + ', ' + profile.server_timing()
+        return response
+
+    def on_error(self, response: http.Response) -> http.Response:
+        _local.request = None
+        return response
@@ -0,0 +1,124 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from .cache import invalidate_expired_sessions
+from .stores import get_session_store
+from . import metrics
+from . import users
+
+logger = logging.getLogger(__name__)
+
+
+class SessionPruner:
+    '''Background job that deletes expired sessions in bounded chunks.
+
+    Every `interval` seconds, expired sessions are deleted `batch_size` rows
+    at a time, oldest first, with a commit after each chunk so that no single
+    delete holds locks for long. `last_run` and `total_rows` report what was
+    deleted.
+
+    '''
+    def __init__(self, session_factory, interval=60.0, batch_size=1000,
+                 store=None):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.store = store
+
+        self._stopped = threading.Event()
+        self._thread = None
+        self.last_run = None
+        self.total_rows = 0
+
+    def run_once(self, session=None):
+        '''Prune all expired sessions and return the number of rows.
+
+        Without a `session`, a new one is created from the session factory
+        and committed after each chunk. A given session is left to the
+        caller to commit.
+
+        '''
+        store = self.store or get_session_store()
+        expiration_date = \
+            datetime.now(timezone.utc) - users.session_expires_after
+
+        owned = session is None
+        if owned:
+            session = self.session_factory()
+
+        started = time.perf_counter()
+        rows = batches = 0
+        try:
+            while True:
+                count = store.prune_batch(session, expiration_date,
+                                          self.batch_size)
+                if owned:
+                    session.commit()
+                rows += count
+                batches += 1
+                if count < self.batch_size:
+                    break
+        except Exception:
+            if owned:
+                session.rollback()
+            raise
+        finally:
+            if owned:
+                session.close()
+
+        invalidate_expired_sessions(expiration_date)
+
+        metrics.pruned.inc('session', amount=rows)
+        self.total_rows += rows
+        self.last_run = {
+            'rows': rows,
+            'batches': batches,
+            'duration': time.perf_counter() - started,
+        }
+        logger.info('pruned %d expired sessions in %d batches', rows,
+                    batches)
+        return rows
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='apistar-auth-pruner', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('failed to prune expired sessions')
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+# Background session pruner, see `enable_session_pruner()`.
+session_pruner = None
+
+
+def enable_session_pruner(session_factory, interval=60.0, batch_size=1000):
+    global session_pruner
+    disable_session_pruner()
+    session_pruner = SessionPruner(session_factory, interval, batch_size)
+    session_pruner.start()
+    atexit.register(session_pruner.stop)
+    return session_pruner
+
+
+def disable_session_pruner():
+    global session_pruner
+    if session_pruner is not None:
+        atexit.unregister(session_pruner.stop)
+        session_pruner.stop()
+        session_pruner = None
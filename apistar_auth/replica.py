@@ -0,0 +1,62 @@
+'''Routing of authentication reads to a read replica.
+
+    enable_read_replica(sessionmaker(bind=replica_engine))
+
+When enabled, the lookups made for every request go to the replica: the
+session lookup, the token lookup and the username lookup of a login. All
+writes (session creation, touches, pruning, user creation) keep using the
+request's session, which is bound to the primary.
+
+A replica lags behind the primary. A lookup that finds nothing on the
+replica is therefore repeated on the primary, so that a session is usable
+right after the login that created it, and a user right after its creation.
+Changes to existing rows, such as deleted sessions or a bumped session
+epoch, are seen once they are replicated.
+
+'''
+
+# Creates sessions bound to the replica, see `enable_read_replica()`. When
+# None, all reads use the request's session.
+replica_session_factory = None
+
+
+def enable_read_replica(session_factory):
+    '''Send authentication reads to the sessions made by `session_factory`.
+
+    The replica must use the same storage mode as the primary, i.e. call
+    `enable_compact_storage()` on both engines or on neither.
+
+    '''
+    global replica_session_factory
+    replica_session_factory = session_factory
+
+
+def disable_read_replica():
+    global replica_session_factory
+    replica_session_factory = None
+
+
+def read(session, query):
+    '''Return `query(s)` for a session `s` bound to the replica, or
+    `query(session)` if that finds nothing.
+
+    Instances returned from the replica are detached from the session. The
+    request's session is used directly when no replica is enabled or when
+    it has pending changes that the query should see.
+
+    '''
+    if replica_session_factory is None or \
+            session.new or session.dirty or session.deleted:
+        return query(session)
+
+    replica = replica_session_factory()
+    try:
+        result = query(replica)
+    finally:
+        # Return the connection to the pool; loaded attributes stay
+        # available on the detached instances.
+        replica.close()
+
+    if result is None:
+        result = query(session)
+    return result
@@ -0,0 +1,85 @@
+import hmac
+import json
+import base64
+import hashlib
+import secrets
+import threading
+
+
+def generate_key():
+    return secrets.token_bytes(32)
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data):
+    padding = '=' * (-len(data) % 4)
+    return base64.urlsafe_b64decode(data + padding)
+
+
+class Keyring:
+    '''Set of HMAC-SHA256 keys to sign and verify payloads.
+
+    Payloads are signed with the current key. Older keys remain valid for
+    verification until they are removed, which allows rotating keys without
+    invalidating everything that was signed before the rotation.
+
+    Signed values have the form `<payload>.<key id>.<signature>`, where the
+    payload is base64url-encoded JSON.
+
+    '''
+    def __init__(self, keys=None, current=None):
+        self._lock = threading.Lock()
+        self._keys = dict(keys or {})
+        if current is None and self._keys:
+            current = sorted(self._keys)[-1]
+        self.current = current
+
+    def rotate(self, key_id, key=None):
+        '''Add a new key and sign with it from now on.'''
+        if '.' in key_id:
+            raise ValueError('key id cannot contain "."')
+        with self._lock:
+            self._keys[key_id] = key if key is not None else generate_key()
+            self.current = key_id
+
+    def remove(self, key_id):
+        '''Stop accepting values signed with the given key.'''
+        with self._lock:
+            if key_id == self.current:
+                raise ValueError('cannot remove the current key')
+            self._keys.pop(key_id, None)
+
+    def _signature(self, key, message):
+        return hmac.new(key, message, hashlib.sha256).digest()
+
+    def sign(self, payload):
+        key_id = self.current
+        if key_id is None:
+            raise ValueError('keyring has no keys')
+
+        data = json.dumps(payload, separators=(',', ':'), sort_keys=True)
+        message = '{}.{}'.format(_b64encode(data.encode('utf-8')), key_id)
+        signature = self._signature(self._keys[key_id],
+                                    message.encode('ascii'))
+        return '{}.{}'.format(message, _b64encode(signature))
+
+    def unsign(self, value):
+        '''Return the payload of a signed value, or None if the value is
+        malformed or its signature is invalid.'''
+        try:
+            data, key_id, signature = value.split('.')
+            key = self._keys.get(key_id)
+            if key is None:
+                return None
+
+            message = '{}.{}'.format(data, key_id).encode('ascii')
+            expected = self._signature(key, message)
+            if not hmac.compare_digest(expected, _b64decode(signature)):
+                return None
+
+            return json.loads(_b64decode(data).decode('utf-8'))
+        except (ValueError, UnicodeError):
+            return None
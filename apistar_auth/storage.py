@@ -0,0 +1,100 @@
+import weakref
+from datetime import datetime, timedelta, timezone
+
+from apistar_sqlalchemy import database
+from sqlalchemy import select, types
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.sql.functions import now
+
+
+# Dialects that support the compact storage mode.
+COMPACT_DIALECTS = ('sqlite', 'mysql')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+# Dialects of the engines for which compact storage is enabled.
+_compact_dialects = weakref.WeakSet()
+
+
+def enable_compact_storage(engine):
+    '''Store GUIDs as BINARY(16) and timestamps as integer microseconds since
+    the epoch in the database of `engine`.
+
+    Only SQLite and MySQL are supported; PostgreSQL already has native UUID
+    and timestamp types. This must be called before the engine is first used,
+    because SQLAlchemy caches the column types per dialect. Existing data is
+    converted with `migrate_storage()`.
+
+    '''
+    if engine.dialect.name not in COMPACT_DIALECTS:
+        raise ValueError('compact storage is not supported on %s'
+                         % engine.dialect.name)
+    _compact_dialects.add(engine.dialect)
+
+
+def uses_compact_storage(dialect):
+    return dialect in _compact_dialects
+
+
+class utc_now(FunctionElement):
+    '''Current timestamp in the storage format of the column.
+
+    This is `now()` with microseconds, except in compact storage mode, where
+    it is the number of microseconds since the epoch.
+
+    '''
+    type = types.DateTime()
+    name = 'utc_now'
+
+
+@compiles(utc_now)
+def compile_utc_now(element, compiler, **kw):
+    if compiler.dialect.name == 'sqlite':
+        if not uses_compact_storage(compiler.dialect):
+            # CURRENT_TIMESTAMP has no fractional seconds. Use the format of
+            # SQLAlchemy's SQLite DATETIME, so timestamps set by the server
+            # and by Python compare equal.
+            return "(STRFTIME('%Y-%m-%d %H:%M:%f000', 'now'))"
+        return "(CAST((julianday('now') - 2440587.5) * 86400000000 " \
+            "AS INTEGER))"
+
+    if not uses_compact_storage(compiler.dialect):
+        return compiler.process(now(), **kw)
+
+    # MySQL 8.0.13 and later accept an expression as column default.
+    return '(CAST(UNIX_TIMESTAMP(CURRENT_TIMESTAMP(6)) * 1000000 AS SIGNED))'
+
+
+def migrate_storage(source_engine, target_engine, metadata=None,
+                    batch_size=1000):
+    '''Copy all tables from `source_engine` to `target_engine`.
+
+    The engines may use different storage modes: rows are read and written
+    through the column types, so GUIDs and timestamps are converted on the
+    way. Tables are created in the target database if they do not exist and
+    are copied in dependency order. Returns the number of rows copied per
+    table.
+
+    '''
+    if metadata is None:
+        metadata = database.Base.metadata
+
+    metadata.create_all(target_engine)
+
+    copied = {}
+    with source_engine.connect() as source, \
+            target_engine.begin() as target:
+        for table in metadata.sorted_tables:
+            result = source.execution_options(stream_results=True) \
+                .execute(select([table]))
+            count = 0
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                target.execute(table.insert(), [dict(row) for row in rows])
+                count += len(rows)
+            copied[table.name] = count
+    return copied
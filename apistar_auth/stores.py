@@ -0,0 +1,355 @@
+import json
+import time
+import uuid
+import secrets
+import threading
+from datetime import datetime, timedelta, timezone
+
+
+from .cache import invalidate_session
+from .models import User, UserSession
+from .pagination import keyset_page
+from .storage import utc_now
+
+
+class SessionStore:
+    '''Storage backend for user sessions.
+
+    Every method receives the SQLAlchemy session of the current request. The
+    SQL store keeps sessions in the `user_sessions` table; the other stores
+    only use it to load user records.
+
+    '''
+    def create(self, session, user):
+        '''Create a new session for `user` and return its id.'''
+        raise NotImplementedError()
+
+    def get(self, session, session_id):
+        '''Return a `(user, updated)` tuple, or None if there is no such
+        session.'''
+        raise NotImplementedError()
+
+    def touch(self, session, session_id):
+        '''Set the session's `updated` field to the current time.'''
+        raise NotImplementedError()
+
+    def touch_many(self, session, session_ids):
+        for session_id in session_ids:
+            self.touch(session, session_id)
+
+    def delete(self, session, session_id):
+        '''Delete the session. Stores also drop it from the session cache,
+        which would otherwise keep resolving it until its entry expires.'''
+        raise NotImplementedError()
+
+    def prune(self, session, expiration_date):
+        '''Delete all sessions last updated before `expiration_date` and
+        return the number of deleted sessions.'''
+        raise NotImplementedError()
+
+    def prune_batch(self, session, expiration_date, batch_size):
+        '''Delete at most `batch_size` of the oldest expired sessions and
+        return the number of deleted sessions.'''
+        return self.prune(session, expiration_date)
+
+    def list(self, session, user_id, after=None, limit=None):
+        '''Return the sessions of a user as objects or dicts with the fields
+        `id`, `user_id`, `created` and `updated`.
+
+        Sessions are ordered by `(updated, id)`, most recent first, and start
+        after the keyset `after` if given. At most `limit` sessions are
+        returned if given.
+
+        '''
+        raise NotImplementedError()
+
+    def load_user(self, session, user_id):
+        return session.query(User).get(user_id)
+
+    def page(self, records, after=None, limit=None):
+        # Order and slice session dicts like `SQLSessionStore.list()`.
+        records = sorted(records, key=lambda record:
+                         (record['updated'], record['id']), reverse=True)
+        if after is not None:
+            records = [record for record in records
+                       if (record['updated'], record['id']) < after]
+        return records if limit is None else records[:limit]
+
+
+class SQLSessionStore(SessionStore):
+    def create(self, session, user):
+        user_session = UserSession(user=user)
+        session.add(user_session)
+        return user_session.id
+
+    def get(self, session, session_id):
+        return session.query(User, UserSession.updated) \
+            .join(UserSession) \
+            .filter(UserSession.id == session_id).first()
+
+    def touch(self, session, session_id):
+        session.query(UserSession) \
+            .filter(UserSession.id == session_id) \
+            .update({'updated': utc_now()}, synchronize_session=False)
+
+    def touch_many(self, session, session_ids, batch_size=500):
+        # Batches stay below SQLite's limit of 999 bound parameters.
+        session_ids = list(session_ids)
+        for i in range(0, len(session_ids), batch_size):
+            session.query(UserSession) \
+                .filter(UserSession.id.in_(session_ids[i:i + batch_size])) \
+                .update({'updated': utc_now()}, synchronize_session=False)
+
+    def delete(self, session, session_id):
+        session.query(UserSession) \
+            .filter(UserSession.id == session_id) \
+            .delete(synchronize_session=False)
+        # Bulk deletes skip the `after_delete` hook of the cache.
+        invalidate_session(session_id)
+
+    def prune(self, session, expiration_date):
+        return session.query(UserSession) \
+            .filter(UserSession.updated <= expiration_date) \
+            .delete(synchronize_session=False)
+
+    def prune_batch(self, session, expiration_date, batch_size):
+        # Select the oldest expired sessions through the index on 'updated'
+        # and delete them by primary key.
+        rows = session.query(UserSession.id) \
+            .filter(UserSession.updated <= expiration_date) \
+            .order_by(UserSession.updated) \
+            .limit(batch_size) \
+            .all()
+        session_ids = [session_id for session_id, in rows]
+
+        for i in range(0, len(session_ids), 500):
+            session.query(UserSession) \
+                .filter(UserSession.id.in_(session_ids[i:i + 500])) \
+                .delete(synchronize_session=False)
+
+        return len(session_ids)
+
+    def list(self, session, user_id, after=None, limit=None):
+        # Rows are fetched in chunks through the (user_id, updated) index.
+        query = session.query(UserSession) \
+            .filter(UserSession.user_id == user_id)
+        return keyset_page(query, [UserSession.updated, UserSession.id],
+                           after, limit, descending=True)
+
+
+def new_session_id():
+    return uuid.UUID(bytes=secrets.token_bytes(16))
+
+
+class MemorySessionStore(SessionStore):
+    '''Keeps sessions in a dict of this process. Sessions are lost on
+    restart and are not shared between processes.'''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def create(self, session, user):
+        session_id = new_session_id()
+        now_utc = datetime.now(timezone.utc)
+        with self._lock:
+            self._sessions[session_id] = {
+                'id': session_id,
+                'user_id': user.id,
+                'created': now_utc,
+                'updated': now_utc,
+            }
+        return session_id
+
+    def get(self, session, session_id):
+        record = self._sessions.get(session_id)
+        if record is None:
+            return None
+
+        user = self.load_user(session, record['user_id'])
+        if user is None:
+            return None
+        return user, record['updated']
+
+    def touch(self, session, session_id):
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is not None:
+                self._sessions[session_id] = dict(
+                    record, updated=datetime.now(timezone.utc))
+
+    def delete(self, session, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        invalidate_session(session_id)
+
+    def prune(self, session, expiration_date):
+        with self._lock:
+            expired = [session_id
+                       for session_id, record in self._sessions.items()
+                       if record['updated'] <= expiration_date]
+            for session_id in expired:
+                del self._sessions[session_id]
+        return len(expired)
+
+    def prune_batch(self, session, expiration_date, batch_size):
+        with self._lock:
+            expired = sorted(
+                (record['updated'], session_id)
+                for session_id, record in self._sessions.items()
+                if record['updated'] <= expiration_date)
+            for _, session_id in expired[:batch_size]:
+                del self._sessions[session_id]
+        return min(len(expired), batch_size)
+
+    def list(self, session, user_id, after=None, limit=None):
+        records = [dict(record) for record in list(self._sessions.values())
+                   if record['user_id'] == user_id]
+        return self.page(records, after, limit)
+
+
+class KeyValueSessionStore(SessionStore):
+    '''Keeps sessions in a shared key-value server, such as Redis or
+    memcached, so that all nodes can authenticate without querying the
+    database for sessions.
+
+    The client must provide `get(key)`, `set(key, value, ttl)` (with `ttl` in
+    seconds) and `delete(key)`. Keys expire after `ttl`, which replaces
+    explicit pruning, so it should not be shorter than the session
+    expiration time.
+
+    '''
+    def __init__(self, client, prefix='apistar_auth:',
+                 ttl=timedelta(days=3 * 30)):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = int(ttl.total_seconds())
+
+    def _session_key(self, session_id):
+        return '{}session:{}'.format(self.prefix, session_id.hex)
+
+    def _user_key(self, user_id):
+        return '{}user:{}'.format(self.prefix, user_id)
+
+    def _load(self, key):
+        value = self.client.get(key)
+        if value is None:
+            return None
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return json.loads(value)
+
+    def _store(self, key, value):
+        self.client.set(key, json.dumps(value), self.ttl)
+
+    def _load_session(self, session_id):
+        record = self._load(self._session_key(session_id))
+        if record is None:
+            return None
+        return {
+            'id': session_id,
+            'user_id': record['user_id'],
+            'created': datetime.fromtimestamp(record['created'],
+                                              timezone.utc),
+            'updated': datetime.fromtimestamp(record['updated'],
+                                              timezone.utc),
+        }
+
+    def create(self, session, user):
+        session_id = new_session_id()
+        now_ts = time.time()
+        self._store(self._session_key(session_id), {
+            'user_id': user.id,
+            'created': now_ts,
+            'updated': now_ts,
+        })
+
+        # Keep an index of the sessions of each user for `list()`. The index
+        # is updated without a lock; a lost update only hides a session from
+        # the listing, it does not affect authentication.
+        user_key = self._user_key(user.id)
+        session_ids = self._load(user_key) or []
+        session_ids.append(session_id.hex)
+        self._store(user_key, session_ids)
+
+        return session_id
+
+    def get(self, session, session_id):
+        record = self._load_session(session_id)
+        if record is None:
+            return None
+
+        user = self.load_user(session, record['user_id'])
+        if user is None:
+            return None
+        return user, record['updated']
+
+    def touch(self, session, session_id):
+        key = self._session_key(session_id)
+        record = self._load(key)
+        if record is not None:
+            record['updated'] = time.time()
+            self._store(key, record)
+
+    def delete(self, session, session_id):
+        self.client.delete(self._session_key(session_id))
+        invalidate_session(session_id)
+
+    def prune(self, session, expiration_date):
+        # Expired sessions are removed by the key-value server itself.
+        return 0
+
+    def list(self, session, user_id, after=None, limit=None):
+        user_key = self._user_key(user_id)
+        session_ids = self._load(user_key) or []
+
+        records = []
+        for session_id in session_ids:
+            record = self._load_session(uuid.UUID(session_id))
+            if record is not None:
+                records.append(record)
+
+        # Drop deleted and expired sessions from the index.
+        if len(records) != len(session_ids):
+            self._store(user_key, [record['id'].hex for record in records])
+
+        return self.page(records, after, limit)
+
+
+class FakeKeyValueClient:
+    '''In-process stand-in for a key-value server, for testing.'''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+
+            value, expires = entry
+            if expires is not None and expires <= time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+session_store = SQLSessionStore()
+
+
+def set_session_store(store):
+    global session_store
+    session_store = store
+
+
+def get_session_store():
+    return session_store
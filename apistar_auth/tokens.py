@@ -1,36 +1,264 @@
-from typing import List
+from datetime import datetime, timedelta, timezone
+import time
+import uuid
 
 from apistar import Route, validators, types, http
+from apistar.exceptions import BadRequest
+from sqlalchemy import func, or_
 from sqlalchemy.orm import Session
 
-from .auth import authorized
-from .models import Token, User
+from .auth import authorized, Unauthorized
+from . import metrics
+from .models import Token, User, UserRole
+from .pagination import (
+    decode_cursor,
+    fetch_limit,
+    get_limit,
+    keyset_page,
+    list_response,
+)
+from .serializers import fast_serializer
+from .storage import utc_now
 from .validators import UUID
 
 
+# Lifetime of new tokens, unless the client asks for a shorter one. None
+# means that tokens do not expire.
+token_expires_after = None
+
+# Minimum time between two writes of a token's 'last_used' field.
+token_last_used_delay = timedelta(minutes=5)
+
+
+# Keyring to sign access and refresh tokens with, see `enable_access_tokens()`.
+access_token_keyring = None
+access_token_expires_after = timedelta(minutes=15)
+refresh_token_expires_after = timedelta(days=30)
+
+
+def enable_access_tokens(keyring, expires_after=timedelta(minutes=15),
+                         refresh_expires_after=timedelta(days=30)):
+    global access_token_keyring, access_token_expires_after, \
+        refresh_token_expires_after
+    access_token_keyring = keyring
+    access_token_expires_after = expires_after
+    refresh_token_expires_after = refresh_expires_after
+
+
+def disable_access_tokens():
+    global access_token_keyring
+    access_token_keyring = None
+
+
+def _sign(payload, expires_after):
+    payload['exp'] = int(time.time() + expires_after.total_seconds())
+    return access_token_keyring.sign(payload)
+
+
+def _unsign(value, token_type):
+    if access_token_keyring is None:
+        return None
+
+    payload = access_token_keyring.unsign(value)
+    if not isinstance(payload, dict) or payload.get('typ') != token_type:
+        return None
+    if payload['exp'] <= time.time():
+        return None
+    return payload
+
+
+def decode_access_token(value):
+    '''Return the payload of a valid, unexpired access token, or None.'''
+    return _unsign(value, 'access')
+
+
+def bearer_token(authorization):
+    '''Return the token of a `Bearer` Authorization header while access
+    tokens are enabled, or None. Other schemes, such as the basic auth of a
+    proxy, are left to the other credentials of the request.'''
+    if access_token_keyring is None or not authorization:
+        return None
+    scheme, _, value = authorization.partition(' ')
+    if scheme.lower() != 'bearer':
+        return None
+    return value.strip()
+
+
+def issue_access_token(token_id, user):
+    access_token = _sign({
+        'typ': 'access',
+        'tid': token_id.hex,
+        'uid': user.id,
+        'role': user.role.name,
+        'epoch': user.session_epoch or 0,
+    }, access_token_expires_after)
+    refresh_token = _sign({
+        'typ': 'refresh',
+        'tid': token_id.hex,
+    }, refresh_token_expires_after)
+
+    return {
+        'access_token': access_token,
+        'token_type': 'bearer',
+        'expires_in': int(access_token_expires_after.total_seconds()),
+        'refresh_token': refresh_token,
+    }
+
+
 class TokenType(types.Type):
     id = UUID()
     user_id = validators.Integer()
 
     created = validators.DateTime()
     updated = validators.DateTime()
+    expires = validators.DateTime(allow_null=True)
+    last_used = validators.DateTime(allow_null=True)
+
+
+serialize_token = fast_serializer(TokenType)
 
 
 @authorized
-def list_tokens(session: Session, user: User) -> List[TokenType]:
-    tokens = session.query(Token).filter(Token.user_id == user.id).all()
-    return list(map(TokenType, tokens))
+def list_tokens(session: Session, user: User, url: http.URL,
+                limit: http.QueryParam, after: http.QueryParam,
+                accept: http.Header) -> http.Response:
+    limit = get_limit(limit)
+    if after:
+        after = decode_cursor(after, (datetime, uuid.UUID))
+
+    query = session.query(*[getattr(Token, key)
+                            for key in serialize_token.fields]) \
+        .filter(Token.user_id == user.id)
+    tokens = keyset_page(query, [Token.updated, Token.id], after or None,
+                         fetch_limit(limit), descending=True)
+    return list_response(tokens, serialize_token,
+                         lambda token: (token.updated, token.id),
+                         url, limit, accept)
 
 
 @authorized
-def create_token(session: Session, user: User) -> http.JSONResponse:
+def create_token(session: Session, user: User,
+                 expires_in: http.QueryParam) -> http.JSONResponse:
+    expires_after = token_expires_after
+
+    if expires_in:
+        try:
+            expires_in = timedelta(seconds=int(expires_in))
+        except ValueError:
+            raise BadRequest({'error': 'expires_in must be an integer'})
+        except OverflowError:
+            raise BadRequest({'error': 'expires_in is too large'})
+        if expires_in <= timedelta(0):
+            raise BadRequest({'error': 'expires_in must be positive'})
+        if expires_after is None or expires_in < expires_after:
+            expires_after = expires_in
+
+    expires = None
+    if expires_after is not None:
+        try:
+            expires = datetime.now(timezone.utc) + expires_after
+        except OverflowError:
+            raise BadRequest({'error': 'expires_in is too large'})
+
     with session.begin_nested():
-        token = Token(user=user)
+        token = Token(user=user, expires=expires)
         session.add(token)
-    return http.JSONResponse(TokenType(token), status_code=201)
+    return http.JSONResponse(serialize_token(token), status_code=201)
+
+
+def touch_tokens(session, token_ids, batch_size=500):
+    '''Set the 'last_used' field of the given tokens to the current time.'''
+    token_ids = list(token_ids)
+    for i in range(0, len(token_ids), batch_size):
+        session.query(Token) \
+            .filter(Token.id.in_(token_ids[i:i + batch_size])) \
+            .update({'last_used': utc_now()}, synchronize_session=False)
+
+
+def prune_tokens(session, idle_after=None, batch_size=1000):
+    '''Delete expired tokens, and tokens unused for `idle_after` if given,
+    in chunks of `batch_size` rows. Returns the number of deleted tokens.'''
+    now_utc = datetime.now(timezone.utc)
+    condition = Token.expires <= now_utc
+    if idle_after is not None:
+        idle_since = now_utc - idle_after
+        condition = condition | (
+            func.coalesce(Token.last_used, Token.created) <= idle_since)
+
+    deleted = 0
+    while True:
+        rows = session.query(Token.id).filter(condition) \
+            .limit(batch_size).all()
+        token_ids = [token_id for token_id, in rows]
+        for i in range(0, len(token_ids), 500):
+            session.query(Token) \
+                .filter(Token.id.in_(token_ids[i:i + 500])) \
+                .delete(synchronize_session=False)
+        deleted += len(token_ids)
+        if len(token_ids) < batch_size:
+            metrics.pruned.inc('token', amount=deleted)
+            return deleted
+
+
+@authorized(UserRole.admin)
+def prune_expired_tokens(session: Session) -> dict:
+    return {'deleted': prune_tokens(session)}
+
+
+class AccessTokenRequestType(types.Type):
+    token = validators.String(min_length=1)
+
+
+class RefreshTokenRequestType(types.Type):
+    refresh_token = validators.String(min_length=1)
+
+
+def _check_enabled():
+    if access_token_keyring is None:
+        raise BadRequest({'error': 'access tokens are not enabled'})
+
+
+def _exchange(session, token_id):
+    try:
+        token_id = uuid.UUID(token_id)
+    except ValueError:
+        raise Unauthorized({'error': 'invalid token'})
+
+    # Expired tokens can neither be exchanged nor refreshed.
+    now_utc = datetime.now(timezone.utc)
+    user = session.query(User) \
+        .join(Token) \
+        .filter(Token.id == token_id) \
+        .filter(or_(Token.expires.is_(None), Token.expires > now_utc)) \
+        .first()
+    if user is None:
+        raise Unauthorized({'error': 'invalid token'})
+
+    return http.JSONResponse(issue_access_token(token_id, user))
+
+
+def create_access_token(session: Session,
+                        data: AccessTokenRequestType) -> http.JSONResponse:
+    _check_enabled()
+    return _exchange(session, data.token)
+
+
+def refresh_access_token(session: Session,
+                         data: RefreshTokenRequestType) -> http.JSONResponse:
+    _check_enabled()
+    payload = _unsign(data.refresh_token, 'refresh')
+    if payload is None:
+        raise Unauthorized({'error': 'invalid refresh token'})
+
+    # The long-lived token is looked up again, so deleting it revokes the
+    # refresh token as well.
+    return _exchange(session, payload['tid'])
 
 
 routes = [
     Route('/tokens', 'GET', list_tokens),
     Route('/tokens', 'POST', create_token),
+    Route('/tokens/access', 'POST', create_access_token),
+    Route('/tokens/refresh', 'POST', refresh_access_token),
+    Route('/tokens/expired', 'DELETE', prune_expired_tokens),
 ]
@@ -0,0 +1,151 @@
+import atexit
+import logging
+import threading
+
+from .stores import get_session_store
+from .tokens import touch_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class TouchBuffer:
+    '''Write-behind buffer for session `updated` touches.
+
+    Requests only record the ids of sessions to refresh. A background thread
+    flushes them every `interval` seconds, or as soon as `max_size` ids are
+    pending, with one bulk update per batch. Sessions are also flushed when
+    the buffer is stopped, which happens at interpreter exit.
+
+    By default the buffered ids are session ids written with the session
+    store's `touch_many()`; another `touch_many(session, ids)` function can
+    be given to buffer other kinds of touches.
+
+    '''
+    def __init__(self, session_factory, interval=5.0, max_size=1000,
+                 store=None, touch_many=None):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.max_size = max_size
+        self.store = store
+        self.touch_many = touch_many
+
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.flushed = 0
+
+    def add(self, session_id):
+        with self._lock:
+            self._pending.add(session_id)
+            full = len(self._pending) >= self.max_size
+            if self._thread is None and not self._stopped.is_set():
+                self._thread = threading.Thread(
+                    target=self._run, name='apistar-auth-touch', daemon=True)
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    def __contains__(self, session_id):
+        return session_id in self._pending
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+        return sorted(pending)
+
+    def _requeue(self, session_ids):
+        # Merged with the ids that were added while the flush was running.
+        with self._lock:
+            self._pending.update(session_ids)
+
+    def flush(self, session=None):
+        '''Write all pending touches and return the number of sessions.
+
+        Without a `session`, a new one is created from the session factory
+        and committed. A given session is left to the caller to commit. If
+        the touches cannot be written, they are queued again for the next
+        flush.
+
+        '''
+        session_ids = self._drain()
+        if not session_ids:
+            return 0
+
+        touch_many = self.touch_many or \
+            (self.store or get_session_store()).touch_many
+
+        try:
+            if session is not None:
+                touch_many(session, session_ids)
+            else:
+                session = self.session_factory()
+                try:
+                    touch_many(session, session_ids)
+                    session.commit()
+                except Exception:
+                    session.rollback()
+                    raise
+                finally:
+                    session.close()
+        except Exception:
+            self._requeue(session_ids)
+            raise
+
+        self.flushed += len(session_ids)
+        return len(session_ids)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('failed to flush session touches')
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+
+# Buffers for session and token touches, see `enable_touch_buffer()`. When
+# None, sessions and tokens are touched synchronously within the request.
+touch_buffer = None
+token_touch_buffer = None
+
+
+def enable_touch_buffer(session_factory, interval=5.0, max_size=1000):
+    global touch_buffer, token_touch_buffer
+    disable_touch_buffer()
+    touch_buffer = TouchBuffer(session_factory, interval, max_size)
+    token_touch_buffer = TouchBuffer(session_factory, interval, max_size,
+                                     touch_many=touch_tokens)
+    atexit.register(touch_buffer.stop)
+    atexit.register(token_touch_buffer.stop)
+    return touch_buffer
+
+
+def disable_touch_buffer():
+    global touch_buffer, token_touch_buffer
+    for buffer in (touch_buffer, token_touch_buffer):
+        if buffer is not None:
+            atexit.unregister(buffer.stop)
+            buffer.stop()
+    touch_buffer = token_touch_buffer = None
+
+
+def get_touch_buffer():
+    return touch_buffer
+
+
+def get_token_touch_buffer():
+    return token_touch_buffer
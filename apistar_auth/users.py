@@ -1,26 +1,105 @@
-from http.cookies import SimpleCookie
-from typing import List
 from datetime import datetime, timedelta, timezone
+import inspect
+import time
 import uuid
 
 from apistar import Route, validators, types, http, Component
-from apistar.exceptions import BadRequest
-from sqlalchemy.orm import Session, class_mapper, ColumnProperty
-from sqlalchemy.sql.functions import now
+from apistar.exceptions import BadRequest, ValidationError
+from apistar.server.wsgi import WSGIEnviron
+from sqlalchemy.orm import (
+    class_mapper,
+    ColumnProperty,
+    object_session,
+    Session,
+)
+from sqlalchemy.orm.session import make_transient_to_detached
 from sqlalchemy.exc import IntegrityError
 
-from .auth import authorized
-from .cookies import SESSION_COOKIE_NAME
-from .models import Token, User, UserRole, UserSession, can_user_create_user
+from .auth import authorized, DeferredUser
+from .cache import session_cache, token_cache, invalidate_expired_sessions
+from .cookies import (
+    decode_signed_session,
+    encode_session,
+    get_request_session_cookie,
+    get_session_cookie,
+    is_revoked,
+    needs_refresh,
+    revoke_epoch,
+    REFRESHED_COOKIE_KEY,
+)
+from . import hasher
+from . import metrics
+from .models import Token, User, UserRole, can_user_create_user
+from . import replica
+from .pagination import (
+    decode_cursor,
+    fetch_limit,
+    get_limit,
+    keyset_page,
+    list_response,
+)
+from .serializers import fast_serializer
+from .stores import get_session_store
+from . import tokens
+from .tokens import decode_access_token
+from .touch import get_token_touch_buffer, get_touch_buffer
 from .validators import UUID
 
 
+# Mapped class -> names of its column attributes.
+_attribute_names = {}
+
+
 def attribute_names(cls):
-    return [
-        prop.key
-        for prop in class_mapper(cls).iterate_properties
-        if isinstance(prop, ColumnProperty)
-    ]
+    names = _attribute_names.get(cls)
+    if names is None:
+        names = _attribute_names[cls] = tuple(
+            prop.key
+            for prop in class_mapper(cls).iterate_properties
+            if isinstance(prop, ColumnProperty)
+        )
+    return names
+
+
+def as_utc(value):
+    # SQLite does not support datetime timezones. Therefore, it will drop
+    # the timezone part. When that's the case, we assume that the timezone
+    # was utc since we're comparing with the current utc time.
+    if value is not None and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def user_snapshot(user):
+    return {key: getattr(user, key) for key in attribute_names(User)}
+
+
+def user_from_snapshot(session, snapshot):
+    # Rebuild a detached user from its column values and attach it to the
+    # session without emitting a query.
+    user = class_mapper(User).class_manager.new_instance()
+    for key, value in snapshot.items():
+        setattr(user, key, value)
+    make_transient_to_detached(user)
+    return session.merge(user, load=False)
+
+
+def attach_user(session, user):
+    # Users read from the replica (see ./replica.py) are detached; attach
+    # them to the request's session without a query.
+    if user is None or object_session(user) is session:
+        return user
+    return user_from_snapshot(session, user_snapshot(user))
+
+
+def user_from_claims(session, payload):
+    # Signed cookies and access tokens only carry the user's id, role and
+    # session epoch. Other attributes are loaded on first access.
+    return user_from_snapshot(session, {
+        'id': payload['uid'],
+        'role': UserRole[payload['role']],
+        'session_epoch': payload['epoch'],
+    })
 
 
 class UserBaseType(types.Type):
@@ -65,82 +144,240 @@ class UserSessionType(types.Type):
     updated = validators.DateTime()
 
 
+serialize_user = fast_serializer(UserType)
+serialize_user_session = fast_serializer(UserSessionType)
+
+
 session_expires_after = timedelta(days=3 * 30)
 session_update_delay = timedelta(days=1)
 
 
+# WSGI environ key under which the deferred user of a request is kept, so
+# that `User` and `DeferredUser` parameters share a single lookup.
+DEFERRED_USER_KEY = 'apistar_auth.user'
+
+
 class UserComponent(Component):
     def __init__(self) -> None:
         pass
 
+    def can_handle_parameter(self, parameter: inspect.Parameter):
+        return parameter.annotation in (User, DeferredUser)
+
     def get_session_id(self, headers):
-        cookie_header = headers.get('cookie')
-        if not cookie_header:
+        return get_request_session_cookie(headers)
+
+    def resolve(self, parameter: inspect.Parameter, request: http.Request,
+                session: Session, token: http.QueryParam,
+                authorization: http.Header, environ: WSGIEnviron
+                # pylint: disable=arguments-differ
+                ) -> User:
+        deferred = environ.get(DEFERRED_USER_KEY)
+        if deferred is None:
+            deferred = DeferredUser(lambda: self.resolve_user(
+                request, session, token, authorization, environ))
+            environ[DEFERRED_USER_KEY] = deferred
+
+        if parameter.annotation is DeferredUser:
+            return deferred
+        return deferred.get()
+
+    def resolve_user(self, request, session, token, authorization, environ):
+        started = time.perf_counter()
+        access_token = tokens.bearer_token(authorization)
+        if access_token or token:
+            method = 'token'
+            user = self.resolve_with_credentials(session, token,
+                                                 access_token)
+        else:
+            session_id = self.get_session_id(request.headers)
+            method = 'cookie' if session_id else 'none'
+            user = self.resolve_with_cookie(request, session, session_id,
+                                            environ) if session_id else None
+
+        metrics.resolve_seconds.observe(time.perf_counter() - started,
+                                        method)
+        return user
+
+    def resolve_with_credentials(self, session, token, access_token):
+        if access_token:
+            return self.resolve_with_access_token(session, access_token)
+
+        try:
+            token = uuid.UUID(token)
+        except ValueError:
             return None
 
-        cookie = SimpleCookie()
-        cookie.load(cookie_header)
+        return self.resolve_with_token(session, token)
+
+    def resolve_with_cookie(self, request, session, session_id, environ):
+        payload = decode_signed_session(session_id)
+        if payload is not None:
+            user = self.resolve_with_signed_session(session, payload)
+            if user is not None and needs_refresh(payload):
+                cookie = get_session_cookie(
+                    request.url, encode_session(payload['sid'], user))
+                environ[REFRESHED_COOKIE_KEY] = cookie.output(header='')
+            return user
 
-        session_id_cookie = cookie.get(SESSION_COOKIE_NAME)
-        if not session_id_cookie:
+        try:
+            session_id = uuid.UUID(session_id)
+        except ValueError:
             return None
 
-        return session_id_cookie.value
+        user = self.resolve_with_cache(session, session_id)
+        if user is not None:
+            return user
 
-    def resolve(self, request: http.Request, session: Session,
-                token: http.QueryParam
-                # pylint: disable=arguments-differ
-                ) -> User:
-        if token:
-            try:
-                token = uuid.UUID(token)
-            except ValueError:
+        return self.resolve_with_session(session, session_id)
+
+    def resolve_with_signed_session(self, session, payload):
+        # Recently issued cookies are trusted without a database lookup.
+        if not needs_refresh(payload) and not is_revoked(payload):
+            return user_from_claims(session, payload)
+
+        # Older cookies are checked against the session store and the user's
+        # current session epoch, and reissued by `SignedSessionCookieHook`.
+        user = self.resolve_with_session(session, payload['sid'])
+
+        if user is None or user.session_epoch != payload['epoch']:
+            return None
+        return user
+
+    def resolve_with_access_token(self, session, access_token):
+        # Access tokens are verified without a database lookup.
+        payload = decode_access_token(access_token)
+        if payload is None or is_revoked(payload):
+            return None
+
+        return user_from_claims(session, payload)
+
+    def resolve_with_token(self, session, token):
+        cached = token_cache.get(token)
+        if cached is not None:
+            snapshot, expires, last_used = cached
+            user = None
+        else:
+            row = replica.read(session, lambda s: s.query(
+                User, Token.expires, Token.last_used)
+                .join(Token)
+                .filter(Token.id == token).first())
+            if row is None:
                 return None
 
-            user = session.query(User) \
-                .join(Token) \
-                .filter(Token.id == token).first()
-            return user
+            user, expires, last_used = row
+            user = attach_user(session, user)
+            snapshot = user_snapshot(user)
+            expires = as_utc(expires)
+            last_used = as_utc(last_used)
 
-        session_id = self.get_session_id(request.headers)
-        if session_id:
-            with session.begin_nested():
-                return self.resolve_with_session(session, session_id)
+        now_utc = datetime.now(timezone.utc)
+
+        # Reject expired tokens. They are deleted by `prune_tokens()`.
+        if expires is not None and expires <= now_utc:
+            token_cache.invalidate(token)
+            return None
+
+        # Like sessions, the token field 'last_used' is written at most once
+        # per 'token_last_used_delay'.
+        if last_used is None or \
+                now_utc - last_used >= tokens.token_last_used_delay:
+            metrics.touches.inc('token')
+            buffer = get_token_touch_buffer()
+            if buffer is not None:
+                buffer.add(token)
+            else:
+                tokens.touch_tokens(session, [token])
+            last_used = now_utc
+            cached = None
+
+        if cached is None:
+            token_cache.set(token, (snapshot, expires, last_used))
+
+        if user is None:
+            user = user_from_snapshot(session, snapshot)
+        return user
+
+    def resolve_with_cache(self, session, session_id):
+        cached = session_cache.get(session_id)
+        if cached is None:
+            return None
 
-        return None
+        snapshot, session_updated = cached
+
+        # Only fresh sessions are served from the cache. Expired sessions and
+        # sessions due for an update take the database path below.
+        if datetime.now(timezone.utc) - session_updated >= \
+                session_update_delay:
+            session_cache.invalidate(session_id)
+            return None
+
+        return user_from_snapshot(session, snapshot)
 
     def resolve_with_session(self, session, session_id):
-        user, session_updated = session.query(User, UserSession.updated) \
-            .join(UserSession) \
-            .filter(UserSession.id == session_id).first()
+        store = get_session_store()
+        row = replica.read(session, lambda s: store.get(s, session_id))
+        if row is None:
+            return None
 
-        # SQLite does not support datetime timezones. Therefore, it will drop
-        # the timezone part. When that's the case, we assume that the timezone
-        # was utc since we're comparing with the current utc time.
-        if session_updated.tzinfo is None:
-            session_updated = session_updated.replace(tzinfo=timezone.utc)
+        user, session_updated = row
+        user = attach_user(session, user)
+        session_updated = as_utc(session_updated)
 
         now_utc = datetime.now(timezone.utc)
 
-        # Reject expired sessions.
+        # Reject expired sessions. They are deleted by the session pruner (see
+        # ./pruning.py) or the '/users/sessions/expired' endpoint.
         if session_updated <= now_utc - session_expires_after:
-            prune_expired_sessions(session)
             return None
 
         # Update session field 'updated' when the difference between now and
         # the last update is more than 'session_update_delay'. This avoids
         # updating the field too often.
         if now_utc - session_updated >= session_update_delay:
-            session.query(UserSession) \
-                .filter(UserSession.id == session_id) \
-                .update({'updated': now()}, synchronize_session=False)
+            metrics.touches.inc('session')
+            buffer = get_touch_buffer()
+            if buffer is not None:
+                buffer.add(session_id)
+            else:
+                # Only the write needs a savepoint; lookups that do not
+                # touch the session take a single round-trip.
+                with session.begin_nested():
+                    store.touch(session, session_id)
+            session_updated = now_utc
+
+        session_cache.set(session_id, (user_snapshot(user), session_updated))
 
         return user
 
 
+def revoke_signed_sessions(session: Session, user: User):
+    '''Invalidate all signed session cookies of a user by bumping their
+    session epoch.'''
+    user.session_epoch = (user.session_epoch or 0) + 1
+    session.flush()
+    revoke_epoch(user.id, user.session_epoch)
+
+
+def _session_keyset(user_session):
+    if isinstance(user_session, dict):
+        return user_session['updated'], user_session['id']
+    return user_session.updated, user_session.id
+
+
 @authorized(UserRole.admin)
-def list_users(session: Session) -> List[UserType]:
-    return list(map(UserType, session.query(User).all()))
+def list_users(session: Session, url: http.URL, limit: http.QueryParam,
+               after: http.QueryParam, accept: http.Header) -> http.Response:
+    limit = get_limit(limit)
+    if after:
+        after = decode_cursor(after, (int,))
+
+    # Only the listed columns are loaded, without building User instances.
+    query = session.query(*[getattr(User, key)
+                            for key in serialize_user.fields])
+    users = keyset_page(query, [User.id], after or None, fetch_limit(limit))
+    return list_response(users, serialize_user, lambda user: (user.id,),
+                         url, limit, accept)
 
 
 def create_user(session: Session, user_data: UserInputType,
@@ -164,28 +401,160 @@ def create_user(session: Session, user_data: UserInputType,
         txn.rollback()
         raise BadRequest({'error': 'username already exists'})
 
-    return http.JSONResponse(UserType(new_user), status_code=201)
+    return http.JSONResponse(serialize_user(new_user), status_code=201)
+
+
+def _check_new_user(user, record):
+    # Returns the validated record, or the result to report instead.
+    if not isinstance(record, dict):
+        return None, {'status': 'invalid', 'error': 'expected an object'}
+
+    try:
+        data = dict(UserInputType.validate(record))
+    except ValidationError as exc:
+        return None, {'status': 'invalid', 'errors': dict(exc.detail)}
+
+    if data.pop('id', None) is not None:
+        return None, {'status': 'invalid', 'error': 'user ID cannot be set'}
+
+    # The role validator allows null, which means the default role.
+    data['role'] = UserRole[data['role'] or 'user']
+
+    # Only the role is needed to check permissions, which avoids hashing the
+    # password in `User.__init__()`.
+    new_user = class_mapper(User).class_manager.new_instance()
+    new_user.role = data['role']
+    if not can_user_create_user(user, new_user):
+        msg = 'user cannot create user with role "{}"'
+        return None, {'status': 'forbidden',
+                      'error': msg.format(data['role'].name)}
+
+    return data, None
+
+
+def _insert_users(session, rows):
+    # Returns the result to report for each username that could not be
+    # inserted.
+    table = User.__table__
+    try:
+        with session.begin_nested():
+            session.execute(table.insert(), rows)
+        return {}
+    except IntegrityError:
+        pass
+
+    # Another request may have created some of these users after they were
+    # checked. Insert them one by one to find out which rows fail, and why.
+    failed = {}
+    for row in rows:
+        try:
+            with session.begin_nested():
+                session.execute(table.insert(), row)
+        except IntegrityError:
+            exists = session.query(User.id) \
+                .filter(User.username == row['username']).first()
+            if exists is not None:
+                failed[row['username']] = {
+                    'status': 'duplicate',
+                    'error': 'username already exists'}
+            else:
+                failed[row['username']] = {
+                    'status': 'failed', 'error': 'user could not be created'}
+    return failed
+
+
+# Largest number of users accepted by `create_users_bulk()` at a time.
+max_bulk_users = 1000
 
 
 @authorized
-def list_user_session(session: Session, user: User) -> List[UserSessionType]:
-    sessions = session.query(UserSession) \
-        .filter(UserSession.user_id == user.id) \
-        .all()
-    return list(map(UserSessionType, sessions))
+def create_users_bulk(session: Session, data: http.RequestData,
+                      user: User) -> dict:
+    '''Create a batch of users and report the result of each record.
+
+    Passwords are hashed in parallel and the users are inserted with a
+    single executemany. Invalid records, records the current user may not
+    create and duplicate usernames are reported without aborting the batch.
+
+    '''
+    if not isinstance(data, list):
+        raise BadRequest({'error': 'expected a list of users'})
+    if len(data) > max_bulk_users:
+        msg = 'at most {} users can be created at a time'
+        raise BadRequest({'error': msg.format(max_bulk_users)})
+
+    results = [None] * len(data)
+    candidates = {}
+    for i, record in enumerate(data):
+        new_user, error = _check_new_user(user, record)
+        if error is not None:
+            results[i] = error
+        elif new_user['username'] in candidates:
+            results[i] = {'status': 'duplicate',
+                          'error': 'duplicate username in batch'}
+        else:
+            candidates[new_user['username']] = (i, new_user)
+
+    usernames = list(candidates)
+    for j in range(0, len(usernames), 500):
+        existing = session.query(User.username) \
+            .filter(User.username.in_(usernames[j:j + 500]))
+        for username, in existing:
+            i, _ = candidates.pop(username)
+            results[i] = {'status': 'duplicate',
+                          'error': 'username already exists'}
+
+    records = list(candidates.values())
+    hashes = hasher.encrypt_many([new_user['password']
+                                  for _, new_user in records])
+    rows = []
+    for (_, new_user), password in zip(records, hashes):
+        new_user['password'] = password
+        rows.append(new_user)
+
+    for username, result in _insert_users(session, rows).items():
+        i, _ = candidates.pop(username)
+        results[i] = result
+
+    usernames = list(candidates)
+    for j in range(0, len(usernames), 500):
+        created = session.query(User.id, User.username) \
+            .filter(User.username.in_(usernames[j:j + 500]))
+        for user_id, username in created:
+            i, _ = candidates[username]
+            results[i] = {'status': 'created', 'id': user_id}
+
+    for i, result in enumerate(results):
+        result['index'] = i
+    return {'created': len(candidates), 'results': results}
+
+
+@authorized
+def list_user_session(session: Session, user: User, url: http.URL,
+                      limit: http.QueryParam, after: http.QueryParam,
+                      accept: http.Header) -> http.Response:
+    limit = get_limit(limit)
+    if after:
+        after = decode_cursor(after, (datetime, uuid.UUID))
+
+    sessions = get_session_store().list(session, user.id, after or None,
+                                        fetch_limit(limit))
+    return list_response(sessions, serialize_user_session, _session_keyset,
+                         url, limit, accept)
 
 
 @authorized
 def prune_expired_sessions(session: Session):
     expiration_date = datetime.now(timezone.utc) - session_expires_after
-    session.query(UserSession) \
-        .filter(UserSession.updated <= expiration_date) \
-        .delete(synchronize_session=False)
+    count = get_session_store().prune(session, expiration_date)
+    metrics.pruned.inc('session', amount=count)
+    invalidate_expired_sessions(expiration_date)
 
 
 routes = [
     Route('/users', 'GET', list_users),
     Route('/users', 'POST', create_user),
+    Route('/users/bulk', 'POST', create_users_bulk),
     Route('/users/sessions', 'GET', list_user_session),
     Route('/users/sessions/expired', 'DELETE', prune_expired_sessions),
 ]
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+'''Compare validated types with the fast serializer for user lists.
+
+Lists N users the way `list_users()` did before (ORM instances validated
+through `UserType`) and with the fast serializer over column rows, and
+reports the time of each step.
+
+    python -m benchmarks.serializers [--rows N] [--repeat N]
+
+'''
+import argparse
+import time
+
+from apistar import http
+from apistar_sqlalchemy import database
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from apistar_auth import User, UserRole
+from apistar_auth.users import serialize_user, UserType
+
+
+def populate(session, rows):
+    users = [{'id': i, 'username': 'user%d' % i, 'password': '-',
+              'role': UserRole.user, 'fullname': 'User %d' % i}
+             for i in range(1, rows + 1)]
+    session.execute(User.__table__.insert(), users)
+    session.commit()
+
+
+def validated(session):
+    users = session.query(User).all()
+    return http.JSONResponse(list(map(UserType, users))).content
+
+
+def fast(session):
+    columns = [getattr(User, key) for key in serialize_user.fields]
+    users = session.query(*columns).yield_per(500)
+    return http.JSONResponse(list(map(serialize_user, users))).content
+
+
+def best_of(fn, session, repeat):
+    timings = []
+    for _ in range(repeat):
+        session.expunge_all()
+        started = time.perf_counter()
+        content = fn(session)
+        timings.append(time.perf_counter() - started)
+    return min(timings), content
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine('sqlite://')
+    database.Base.metadata.create_all(engine)
+    session = Session(bind=engine)
+    populate(session, args.rows)
+
+    validated_time, validated_content = \
+        best_of(validated, session, args.repeat)
+    fast_time, fast_content = best_of(fast, session, args.repeat)
+    assert validated_content == fast_content
+
+    print('%-24s %10s' % ('path (%d rows)' % args.rows, 'ms'))
+    print('%-24s %10.1f' % ('validated types', validated_time * 1e3))
+    print('%-24s %10.1f' % ('fast serializer', fast_time * 1e3))
+    print('%-24s %10.1fx' % ('speedup', validated_time / fast_time))
+
+
+if __name__ == '__main__':
+    main()
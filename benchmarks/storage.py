@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+'''Compare the default and the compact storage mode on SQLite.
+
+Creates a database with N users, sessions and tokens in both modes and
+reports the size of each table and index, and the time of session id
+lookups and `updated` range scans.
+
+    python -m benchmarks.storage [--rows N] [--lookups N]
+
+'''
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from apistar_sqlalchemy import database
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from apistar_auth import (
+    enable_compact_storage,
+    Token,
+    User,
+    UserRole,
+    UserSession,
+)
+
+
+def populate(engine, rows):
+    database.Base.metadata.create_all(engine)
+
+    now = datetime.now(timezone.utc)
+    users = [{'id': i, 'username': 'user%d' % i, 'password': '-',
+              'role': UserRole.user} for i in range(1, rows + 1)]
+    sessions = []
+    tokens = []
+    for i in range(1, rows + 1):
+        updated = now - timedelta(seconds=random.randrange(90 * 86400))
+        sessions.append({'id': UserSession.generate_session_id(None),
+                         'user_id': i, 'created': updated,
+                         'updated': updated})
+        tokens.append({'id': Token.generate_session_id(None), 'user_id': i,
+                       'created': updated, 'updated': updated})
+
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), users)
+        conn.execute(UserSession.__table__.insert(), sessions)
+        conn.execute(Token.__table__.insert(), tokens)
+
+    return [record['id'] for record in sessions]
+
+
+def object_sizes(path):
+    conn = sqlite3.connect(path)
+    try:
+        return dict(conn.execute(
+            'SELECT name, SUM(pgsize) FROM dbstat GROUP BY name'))
+    except sqlite3.OperationalError:
+        # SQLite was built without the dbstat virtual table.
+        page_size, = conn.execute('PRAGMA page_size').fetchone()
+        page_count, = conn.execute('PRAGMA page_count').fetchone()
+        return {'(database)': page_size * page_count}
+    finally:
+        conn.close()
+
+
+def measure(engine, session_ids, lookups):
+    session = Session(bind=engine)
+    sample = random.sample(session_ids, min(lookups, len(session_ids)))
+
+    started = time.perf_counter()
+    for session_id in sample:
+        session.query(UserSession).get(session_id)
+        session.expunge_all()
+    lookup = (time.perf_counter() - started) / len(sample)
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=30)
+    started = time.perf_counter()
+    count = session.query(UserSession) \
+        .filter(UserSession.updated < cutoff).count()
+    expired = session.query(UserSession) \
+        .filter(UserSession.updated < cutoff).all()
+    scan = time.perf_counter() - started
+    assert len(expired) == count
+
+    session.close()
+    return lookup, scan
+
+
+def run(mode, rows, lookups, directory):
+    path = os.path.join(directory, '%s.db' % mode)
+    engine = create_engine('sqlite:///' + path)
+    if mode == 'compact':
+        enable_compact_storage(engine)
+
+    session_ids = populate(engine, rows)
+    lookup, scan = measure(engine, session_ids, lookups)
+    engine.dispose()
+    return object_sizes(path), lookup, scan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--lookups', type=int, default=5000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ('default', 'compact'):
+            results[mode] = run(mode, args.rows, args.lookups, directory)
+
+    default, compact = results['default'], results['compact']
+    print('%-40s %12s %12s' % ('object (bytes)', 'default', 'compact'))
+    for name in sorted(set(default[0]) | set(compact[0])):
+        print('%-40s %12d %12d' % (name, default[0].get(name, 0),
+                                   compact[0].get(name, 0)))
+    print('%-40s %12.1f %12.1f' % ('session id lookup (us)',
+                                   default[1] * 1e6, compact[1] * 1e6))
+    print('%-40s %12.1f %12.1f' % ('updated range scan (ms)',
+                                   default[2] * 1e3, compact[2] * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+'''Request benchmarks for user resolution, login, user creation and lists.
+
+Runs every benchmark through the test client against an app from
+`tests.testutil.create_app()`, on SQLite databases with N users, and N
+sessions and tokens of the benchmarking user. Reports requests per second
+and latency percentiles, and writes all results as JSON so that they can be
+compared between versions:
+
+    python -m benchmarks.suite --output old.json
+    (upgrade)
+    python -m benchmarks.suite --output new.json --compare old.json
+
+Logins and user creation hash passwords with bcrypt (12 rounds by default,
+see `--bcrypt-rounds`).
+
+'''
+import argparse
+from datetime import datetime, timedelta, timezone
+import itertools
+import json
+import platform
+import sys
+import time
+
+from apistar import TestClient
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+import apistar_auth
+from apistar_auth import (
+    enable_bcrypt_hasher,
+    SESSION_COOKIE_NAME,
+    Token,
+    User,
+    UserRole,
+    UserSession,
+)
+from apistar_auth.pagination import NDJSON_MEDIA_TYPE
+from apistar_auth.profiling import disable_query_log
+from tests import db_logger  # noqa: F401
+
+# The tests print every SQL statement, which is not what we measure. The
+# log is disabled before the test apps are created.
+disable_query_log()
+
+from tests.testutil import create_app  # noqa: E402
+
+# Benchmark name -> function that returns the request to repeat, see
+# `benchmark()`.
+benchmarks = {}
+
+
+def benchmark(fn):
+    benchmarks[fn.__name__] = fn
+    return fn
+
+
+def populate(engine, rows, password):
+    '''Create `rows` users, and as many sessions and tokens of an admin.
+    Returns the ids of the admin's first session and token.'''
+    session = Session(bind=engine)
+    admin = User(username='admin', password=password, role='admin',
+                 fullname='Benchmark admin')
+    session.add(admin)
+    session.commit()
+    admin_id = admin.id
+    session.close()
+
+    now = datetime.now(timezone.utc)
+    users = [{'username': 'user%d' % i, 'password': '-',
+              'role': UserRole.user, 'fullname': 'User %d' % i}
+             for i in range(rows)]
+    sessions = []
+    tokens = []
+    for i in range(rows):
+        updated = now - timedelta(seconds=i)
+        sessions.append({'id': UserSession.generate_session_id(None),
+                         'user_id': admin_id, 'created': updated,
+                         'updated': updated})
+        tokens.append({'id': Token.generate_session_id(None),
+                       'user_id': admin_id, 'created': updated,
+                       'updated': updated, 'last_used': updated})
+
+    with engine.begin() as conn:
+        for i in range(0, rows, 10000):
+            conn.execute(User.__table__.insert(), users[i:i + 10000])
+            conn.execute(UserSession.__table__.insert(),
+                         sessions[i:i + 10000])
+            conn.execute(Token.__table__.insert(), tokens[i:i + 10000])
+
+    return sessions[0]['id'], tokens[0]['id']
+
+
+class Context:
+    def __init__(self, app, session_id, token_id, password):
+        self.app = app
+        self.password = password
+        self.token_id = str(token_id)
+
+        self.client = TestClient(app['app'], hostname='testserver.local')
+        self.client.cookies[SESSION_COOKIE_NAME] = str(session_id)
+        self.anonymous = TestClient(app['app'], hostname='testserver.local')
+
+
+def check(resp, status_code=200):
+    if resp.status_code != status_code:
+        raise AssertionError('{} {}: {}'.format(
+            resp.request.method, resp.request.url, resp.text))
+
+
+@benchmark
+def cookie_auth(ctx):
+    return lambda: check(ctx.client.get('/users/sessions',
+                                        params={'limit': 1}))
+
+
+@benchmark
+def token_auth(ctx):
+    return lambda: check(ctx.anonymous.get(
+        '/tokens', params={'limit': 1, 'token': ctx.token_id}))
+
+
+@benchmark
+def login(ctx):
+    data = {'username': 'admin', 'password': ctx.password}
+    return lambda: check(ctx.anonymous.post('/login', json=data))
+
+
+@benchmark
+def create_user(ctx):
+    counter = itertools.count()
+
+    def request():
+        check(ctx.client.post('/users', json={
+            'username': 'new%d' % next(counter), 'password': 'secret',
+            'role': 'user', 'fullname': 'New user'}), 201)
+    return request
+
+
+@benchmark
+def list_users_page(ctx):
+    return lambda: check(ctx.client.get('/users', params={'limit': 100}))
+
+
+@benchmark
+def list_users_all(ctx):
+    headers = {'Accept': NDJSON_MEDIA_TYPE}
+    return lambda: check(ctx.client.get('/users', headers=headers))
+
+
+@benchmark
+def list_sessions_page(ctx):
+    return lambda: check(ctx.client.get('/users/sessions',
+                                        params={'limit': 100}))
+
+
+@benchmark
+def list_tokens_page(ctx):
+    return lambda: check(ctx.client.get('/tokens', params={'limit': 100}))
+
+
+def percentile(timings, fraction):
+    # Nearest-rank percentile of sorted timings.
+    index = max(0, int(round(fraction * len(timings))) - 1)
+    return timings[min(index, len(timings) - 1)]
+
+
+def measure(request, duration, min_ops, warmup):
+    for _ in range(warmup):
+        request()
+
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < min_ops or \
+            time.perf_counter() - started < duration:
+        begin = time.perf_counter()
+        request()
+        timings.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - started
+
+    timings.sort()
+    return {
+        'ops': len(timings),
+        'seconds': elapsed,
+        'rps': len(timings) / elapsed,
+        'latency_ms': {
+            'mean': sum(timings) / len(timings) * 1e3,
+            'min': timings[0] * 1e3,
+            'p50': percentile(timings, 0.5) * 1e3,
+            'p95': percentile(timings, 0.95) * 1e3,
+            'p99': percentile(timings, 0.99) * 1e3,
+            'max': timings[-1] * 1e3,
+        },
+    }
+
+
+def run(args, rows, names):
+    app = create_app('sqlite:///:memory:', args.compact_storage, commit=True)
+    database = app['database']
+    database.Session.remove()
+    database.Session.configure(bind=app['engine'])
+
+    password = 'benchmark'
+    session_id, token_id = populate(app['engine'], rows, password)
+    ctx = Context(app, session_id, token_id, password)
+
+    results = []
+    for name in names:
+        result = {'name': name, 'rows': rows,
+                  'storage': 'compact' if args.compact_storage
+                  else 'default'}
+        result.update(measure(benchmarks[name](ctx), args.duration,
+                              args.min_ops, args.warmup))
+        results.append(result)
+        report(result)
+
+    database.Session.remove()
+    app['engine'].dispose()
+    return results
+
+
+def report(result, stream=sys.stderr):
+    latency = result['latency_ms']
+    stream.write('%-20s %8d rows %8d ops %10.1f req/s %9.2f ms p50 '
+                 '%9.2f ms p99\n' % (result['name'], result['rows'],
+                                     result['ops'], result['rps'],
+                                     latency['p50'], latency['p99']))
+
+
+def compare(results, baseline, max_regression, stream=sys.stderr):
+    '''Print the change of the median latency against a baseline, and
+    return the names of benchmarks that slowed down by more than
+    `max_regression`.'''
+    def key(result):
+        return result['name'], result['rows'], result['storage']
+
+    previous = {key(result): result for result in baseline['results']}
+    regressions = []
+    stream.write('\ncompared to %s (%s):\n' % (baseline['version'],
+                                               baseline['started']))
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        change = result['latency_ms']['p50'] / old['latency_ms']['p50'] - 1
+        stream.write('%-20s %8d rows %+9.1f%% p50\n' % (
+            result['name'], result['rows'], change * 100))
+        if change > max_regression:
+            regressions.append('%s/%d' % (result['name'], result['rows']))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', default='1000,100000',
+                        help='comma-separated database sizes '
+                        '(default: 1000,100000)')
+    parser.add_argument('--only', help='comma-separated benchmark names '
+                        '(default: all of %s)' % ', '.join(benchmarks))
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help='seconds per benchmark (default: 2)')
+    parser.add_argument('--min-ops', type=int, default=5,
+                        help='minimum requests per benchmark (default: 5)')
+    parser.add_argument('--warmup', type=int, default=2,
+                        help='unmeasured requests first (default: 2)')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--compact-storage', action='store_true')
+    parser.add_argument('--output', default='-',
+                        help='JSON results file (default: stdout)')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='JSON results of an earlier run')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='with --compare, fail when a median latency '
+                        'grew by more than this fraction (default: 0.2)')
+    args = parser.parse_args(argv)
+
+    args.rows = [int(rows) for rows in args.rows.split(',')]
+    args.only = args.only.split(',') if args.only else list(benchmarks)
+    unknown = set(args.only) - set(benchmarks)
+    if unknown:
+        parser.error('unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    enable_bcrypt_hasher(args.bcrypt_rounds)
+
+    output = {
+        'version': apistar_auth.__version__,
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'platform': platform.platform(),
+        'started': datetime.now(timezone.utc).isoformat(),
+        'config': {'bcrypt_rounds': args.bcrypt_rounds,
+                   'duration': args.duration, 'min_ops': args.min_ops,
+                   'warmup': args.warmup},
+        'results': [],
+    }
+    for rows in args.rows:
+        output['results'] += run(args, rows, args.only)
+
+    data = json.dumps(output, indent=2, sort_keys=True) + '\n'
+    if args.output == '-':
+        sys.stdout.write(data)
+    else:
+        with open(args.output, 'w') as stream:
+            stream.write(data)
+
+    if args.compare:
+        with open(args.compare) as stream:
+            baseline = json.load(stream)
+        regressions = compare(output['results'], baseline,
+                              args.max_regression)
+        if regressions:
+            sys.stderr.write('regressions: %s\n' % ', '.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -68,6 +68,14 @@ setup(
     download_url='https://github.com/smvv/apistar-auth',
     packages=get_packages(package_name),
     package_data=get_package_data(package_name),
+    entry_points={
+        'console_scripts': [
+            'apistar-auth = apistar_auth.cli:main',
+        ],
+    },
+    extras_require={
+        'async': ['aiosqlite'],
+    },
     install_requires=[
         'apistar',
         'apistar-sqlalchemy',
@@ -0,0 +1,117 @@
+import asyncio
+from datetime import timedelta
+import uuid
+
+from apistar import ASyncApp, TestClient
+from apistar_sqlalchemy import database
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+import pytest
+
+from apistar_auth import (
+    enable_compact_storage,
+    enable_session_cache,
+    SESSION_COOKIE_NAME,
+    Token,
+    User,
+)
+from apistar_auth import aio
+import apistar_auth.users
+
+from .testutil import TestCaseUnauthenticatedBase
+
+
+class TestCaseAsync(TestCaseUnauthenticatedBase):
+    @pytest.fixture(scope='function', params=[False, True],
+                    ids=['default', 'compact'])
+    def async_app(self, request, tmpdir, user_data):
+        path = str(tmpdir.join('auth.db'))
+        engine = create_engine('sqlite:///' + path)
+        async_database = aio.AsyncDatabase(path)
+        if request.param:
+            enable_compact_storage(engine)
+            enable_compact_storage(async_database)
+        database.Base.metadata.create_all(engine)
+
+        # Users are created through the synchronous ORM, in the same file.
+        session = Session(bind=engine)
+        user = User(**user_data)
+        session.add_all([user, Token(user=user)])
+        session.commit()
+
+        # Without the documentation routes, ASyncApp does not need aiofiles.
+        app = ASyncApp(
+            routes=aio.routes, schema_url=None, docs_url=None,
+            components=[aio.AsyncDatabaseComponent(async_database),
+                        aio.AsyncUserComponent()],
+            event_hooks=[aio.AsyncAuthorizationHook(aio.routes)],
+        )
+        yield {'app': app, 'database': async_database, 'session': session}
+        session.close()
+        asyncio.get_event_loop().run_until_complete(async_database.close())
+
+    def test_login_and_list(self, async_app, user_data):
+        client = TestClient(async_app['app'], hostname='testserver.local')
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 401
+
+        resp = client.post('/login', json=dict(user_data, password='x'))
+        assert resp.status_code == 400
+
+        resp = client.post('/login', json=user_data)
+        assert resp.status_code == 200
+        assert resp.json()['username'] == user_data['username']
+        session_id = resp.cookies[SESSION_COOKIE_NAME]
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+        assert [s['id'] for s in resp.json()] == [session_id]
+
+        # The synchronous code reads the same sessions.
+        session = async_app['session']
+        assert str(session.query(User).one().sessions[0].id) == session_id
+
+        resp = client.get('/tokens')
+        assert resp.status_code == 200
+        token_id = resp.json()[0]['id']
+        assert resp.json()[0]['last_used'] is None
+
+        client.cookies.clear()
+        resp = client.get('/tokens', params={'token': token_id})
+        assert resp.status_code == 200
+        assert resp.json()[0]['last_used'] is not None
+
+    def test_session_settings(self, async_app, user_data):
+        client = TestClient(async_app['app'], hostname='testserver.local')
+        resp = client.post('/login', json=user_data)
+        assert resp.status_code == 200
+
+        # The session settings of `apistar_auth.users` are read on every
+        # request, as in the synchronous component.
+        expires_after = apistar_auth.users.session_expires_after
+        apistar_auth.users.session_expires_after = timedelta(0)
+        try:
+            resp = client.get('/users/sessions')
+            assert resp.status_code == 401
+        finally:
+            apistar_auth.users.session_expires_after = expires_after
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+
+    def test_concurrent_resolution(self, async_app, user_data):
+        enable_session_cache()
+        client = TestClient(async_app['app'], hostname='testserver.local')
+        resp = client.post('/login', json=user_data)
+        assert resp.status_code == 200
+        session_id = uuid.UUID(resp.cookies[SESSION_COOKIE_NAME])
+
+        # Many lookups share the event loop; the first ones go to the
+        # database and the others are served from the session cache.
+        component = aio.AsyncUserComponent()
+        users = asyncio.get_event_loop().run_until_complete(asyncio.gather(*[
+            component.resolve_with_session(async_app['database'], session_id)
+            for _ in range(100)
+        ]))
+        assert {user.username for user in users} == {user_data['username']}
@@ -1,5 +1,24 @@
+from apistar import Include, Route
+from apistar.exceptions import ConfigurationError
+from sqlalchemy import event
+import pytest
+
 from .testutil import TestCaseUnauthenticatedBase
-from apistar_auth import SESSION_COOKIE_NAME
+from apistar_auth import (
+    AuthorizationHook,
+    authorized,
+    DeferredUser,
+    load_permissions,
+    routes,
+    SESSION_COOKIE_NAME,
+    Unauthorized,
+    User,
+    UserRole,
+)
+from apistar_auth import permissions
+from apistar_auth.login import login
+from apistar_auth.tokens import list_tokens
+from apistar_auth.users import list_users
 
 
 class TestCaseAuth(TestCaseUnauthenticatedBase):
@@ -47,3 +66,113 @@ class TestCaseAuth(TestCaseUnauthenticatedBase):
         resp = client.get('/users', json=user_data)
         assert resp.status_code == 401
         assert resp.json()['error'] == error_no_user_found
+
+    def test_public_route_skips_user_lookup(self, app, client, user_data):
+        resp = client.post('/users', json=user_data)
+        assert resp.status_code == 201
+
+        resp = client.post('/login', json=user_data)
+        assert resp.status_code == 200
+
+        resp = client.post('/tokens')
+        assert resp.status_code == 201
+        token = resp.json()['id']
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(app['engine'], 'before_cursor_execute', record)
+        try:
+            resp = client.post('/login', json=user_data,
+                               params=dict(token=token))
+            assert resp.status_code == 200
+            assert not any('tokens' in s for s in statements)
+
+            del statements[:]
+            resp = client.get('/tokens', params=dict(token=token))
+            assert resp.status_code == 200
+            assert sum('JOIN tokens' in s for s in statements) == 1
+        finally:
+            event.remove(app['engine'], 'before_cursor_execute', record)
+
+    def test_compiled_policies(self):
+        hook = AuthorizationHook(routes)
+        assert hook.policies[login] is None
+        assert hook.policies[list_tokens].mask is None
+        assert hook.policies[list_users].mask == \
+            permissions.role_bits[UserRole.admin]
+
+    def test_misconfigured_route(self):
+        @authorized('admin')
+        def handler():
+            pass
+
+        with pytest.raises(ConfigurationError):
+            AuthorizationHook([Include('/api', 'api', [
+                Route('/handler', 'GET', handler),
+            ])])
+
+    def test_unknown_permission(self):
+        @authorized(permission='unknown')
+        def handler():
+            pass
+
+        with pytest.raises(ConfigurationError):
+            AuthorizationHook([Route('/handler', 'GET', handler)])
+
+
+class TestCasePermissions(TestCaseUnauthenticatedBase):
+    def teardown_method(self, test_method):
+        load_permissions()
+
+    def authorize(self, handler, role):
+        route = Route('/handler', 'GET', handler)
+        hook = AuthorizationHook([route])
+        user = User(username='u', password='p', role=role.name)
+        hook.on_request(route, DeferredUser(lambda: user))
+
+    def test_multiple_roles(self):
+        @authorized({UserRole.admin, UserRole.user})
+        def handler():
+            pass
+
+        self.authorize(handler, UserRole.admin)
+        self.authorize(handler, UserRole.user)
+
+    def test_named_permissions(self):
+        load_permissions({
+            UserRole.admin: {'users.list', 'users.delete'},
+            UserRole.user: {'users.list'},
+        })
+
+        @authorized(permission='users.list')
+        def list_handler():
+            pass
+
+        @authorized(permission={'users.delete'})
+        def delete_handler():
+            pass
+
+        self.authorize(list_handler, UserRole.admin)
+        self.authorize(list_handler, UserRole.user)
+        self.authorize(delete_handler, UserRole.admin)
+
+        with pytest.raises(Unauthorized) as exc_info:
+            self.authorize(delete_handler, UserRole.user)
+        error = exc_info.value.detail['error']
+        assert error == 'invalid user role "user" (expected: "users.delete")'
+
+    def test_role_and_permission_masks(self):
+        load_permissions({
+            UserRole.admin: {'a', 'b'},
+            UserRole.user: {'b'},
+        })
+        admin_mask = permissions.role_mask(UserRole.admin)
+        user_mask = permissions.role_mask(UserRole.user)
+
+        assert admin_mask & permissions.required_mask(permissions=['a'])
+        assert not user_mask & permissions.required_mask(permissions=['a'])
+        assert user_mask & permissions.required_mask(permissions=['b'])
+        assert not admin_mask & permissions.required_mask([UserRole.user])
@@ -0,0 +1,175 @@
+from datetime import datetime, timezone
+
+from .testutil import TestCaseUnauthenticatedBase
+
+from apistar_auth import (
+    enable_session_cache,
+    enable_token_cache,
+    invalidate_session,
+    Token,
+    User,
+    UserRole,
+    UserSession,
+)
+from apistar_auth.cache import LRUCache, session_cache, token_cache
+from apistar_auth.users import session_update_delay
+
+
+class TestCaseCache(TestCaseUnauthenticatedBase):
+    def test_lru_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == 1
+
+        # 'b' is the least recently used entry.
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+
+        stats = cache.stats()
+        assert stats['hits'] == 3
+        assert stats['misses'] == 1
+        assert stats['evictions'] == 1
+        assert stats['size'] == 2
+
+    def test_ttl_expiry(self):
+        cache = LRUCache(maxsize=2, ttl=0)
+        cache.set('a', 1)
+        assert cache.get('a') is None
+        assert cache.stats()['evictions'] == 1
+        assert len(cache) == 0
+
+    def test_disabled_cache(self):
+        cache = LRUCache(maxsize=0)
+        cache.set('a', 1)
+        assert cache.get('a') is None
+        assert cache.stats()['misses'] == 0
+
+    def test_invalidate_where(self):
+        cache = LRUCache(maxsize=10)
+        for i in range(5):
+            cache.set(i, i)
+        cache.invalidate_where(lambda key, value: value % 2)
+        assert len(cache) == 3
+        assert cache.stats()['invalidations'] == 2
+
+    def test_session_cache_hit(self, client, user_data):
+        enable_session_cache()
+        self.login(client, user_data)
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+        assert session_cache.stats()['misses'] == 1
+        assert len(session_cache) == 1
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+        assert session_cache.stats()['hits'] == 1
+
+        resp = client.post('/tokens')
+        assert resp.status_code == 201
+        assert session_cache.stats()['hits'] == 2
+
+    def test_session_cache_invalidation(self, client, user_data, session):
+        enable_session_cache()
+        self.login(client, user_data)
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+        session_id = resp.json()[0]['id']
+        assert len(session_cache) == 1
+
+        invalidate_session(session_id)
+        assert len(session_cache) == 0
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+        assert len(session_cache) == 1
+
+        # Role changes drop all cached sessions of the user.
+        user = session.query(User).filter_by(username='user').one()
+        user.role = UserRole.admin
+        session.flush()
+        assert len(session_cache) == 0
+
+        resp = client.get('/users')
+        assert resp.status_code == 200
+
+        # Deleting the session drops it from the cache as well.
+        session.delete(session.query(UserSession).one())
+        session.flush()
+        assert len(session_cache) == 0
+
+        resp = client.get('/users')
+        assert resp.status_code == 401
+
+    def test_session_cache_update_delay(self, client, user_data, session):
+        enable_session_cache()
+        self.login(client, user_data)
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+
+        # Sessions due for an update bypass the cache.
+        session_id = session.query(UserSession).one().id
+        snapshot, _ = session_cache.get(session_id)
+        updated = datetime.now(timezone.utc) - session_update_delay
+        session_cache.set(session_id, (snapshot, updated))
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+
+        _, cached_updated = session_cache.get(session_id)
+        assert cached_updated > updated
+
+    def test_token_cache_hit(self, client, user_data):
+        enable_token_cache(maxsize=10, ttl=60)
+        token = self.create_token(client, user_data)
+
+        for _ in range(3):
+            resp = client.get('/tokens', params=dict(token=token))
+            assert resp.status_code == 200
+            assert resp.json()[0]['id'] == token
+
+        stats = token_cache.stats()
+        assert stats['misses'] == 1
+        assert stats['hits'] == 2
+        assert session_cache.stats()['size'] == 0
+
+    def test_token_cache_revocation(self, client, user_data, session):
+        enable_token_cache()
+        token = self.create_token(client, user_data)
+
+        resp = client.get('/tokens', params=dict(token=token))
+        assert resp.status_code == 200
+        assert len(token_cache) == 1
+
+        session.delete(session.query(Token).one())
+        session.flush()
+        assert len(token_cache) == 0
+
+        resp = client.get('/tokens', params=dict(token=token))
+        assert resp.status_code == 401
+
+    def test_token_cache_user_change(self, client, user_data, session):
+        enable_token_cache()
+        token = self.create_token(client, user_data)
+
+        resp = client.get('/tokens', params=dict(token=token))
+        assert resp.status_code == 200
+        assert len(token_cache) == 1
+
+        session.query(User).update({'fullname': 'bar'},
+                                   synchronize_session=False)
+        assert len(token_cache) == 0
+
+        resp = client.get('/tokens', params=dict(token=token))
+        assert resp.status_code == 200
+        assert len(token_cache) == 1
+
+        user = session.query(User).filter_by(username='user').one()
+        user.role = UserRole.admin
+        session.flush()
+        assert len(token_cache) == 0
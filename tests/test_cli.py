@@ -0,0 +1,108 @@
+import io
+import json
+
+from apistar_sqlalchemy import database
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from apistar_auth import User
+from apistar_auth.cli import export_users, import_users, main
+from apistar_auth.hasher import encrypt
+
+from .testutil import TestCaseUnauthenticatedBase
+
+
+class TestCaseCli(TestCaseUnauthenticatedBase):
+    def new_session(self):
+        # Imports commit, so they do not run in the test transaction.
+        engine = create_engine('sqlite://')
+        database.Base.metadata.create_all(engine)
+        return Session(bind=engine)
+
+    def test_import_hashed_passwords(self):
+        session = self.new_session()
+        stream = io.StringIO(
+            'username,password,role,fullname\n'
+            'alice,{},user,Alice\n'
+            'bob,plaintext,user,Bob\n'
+            'carol,{},boss,Carol\n'
+            'alice,{},admin,Alice\n'.format(encrypt('a'), encrypt('c'),
+                                            encrypt('x')))
+        errors = io.StringIO()
+
+        counts = import_users(session, stream, errors=errors)
+        assert counts == {'imported': 1, 'skipped': 1, 'invalid': 2}
+        assert 'record 2: unrecognised password hash' in errors.getvalue()
+        assert "record 3: invalid role 'boss'" in errors.getvalue()
+
+        alice = session.query(User).filter_by(username='alice').one()
+        assert alice.verify_password('a')
+        assert alice.role.name == 'user'
+
+    def test_import_plaintext_jsonl(self):
+        session = self.new_session()
+        records = [{'username': 'user%d' % i, 'password': 'pw%d' % i,
+                    'role': 'user'} for i in range(5)]
+        stream = io.StringIO(''.join(json.dumps(r) + '\n' for r in records))
+
+        counts = import_users(session, stream, 'jsonl', batch_size=2,
+                              plaintext=True)
+        assert counts == {'imported': 5, 'skipped': 0, 'invalid': 0}
+
+        user = session.query(User).filter_by(username='user3').one()
+        assert user.verify_password('pw3')
+
+    def test_import_invalid_jsonl(self):
+        session = self.new_session()
+        stream = io.StringIO(
+            '{"username": "alice", "password": "a"}\n'
+            '{"username": "bob", \n'
+            '\n'
+            '["carol", "c"]\n'
+            'null\n'
+            '{"username": "dave", "password": "d"}\n'
+            '{"username": "erin", "password": 5}\n'
+            '{"username": "frank", "password": "f", "role": ["x"]}\n'
+            '{"username": "grace", "password": "g", "fullname": {}}\n')
+        errors = io.StringIO()
+
+        counts = import_users(session, stream, 'jsonl', plaintext=True,
+                              errors=errors)
+        assert counts == {'imported': 2, 'skipped': 0, 'invalid': 6}
+        assert errors.getvalue() == (
+            'record 2: invalid JSON\n'
+            'record 3: expected an object\n'
+            'record 4: expected an object\n'
+            "record 6: field 'password' must be a string\n"
+            "record 7: field 'role' must be a string\n"
+            "record 8: field 'fullname' must be a string\n")
+        assert session.query(User).count() == 2
+
+    def test_export_and_import(self, tmpdir, capsys):
+        source = 'sqlite:///{}'.format(tmpdir.join('source.db'))
+        target = 'sqlite:///{}'.format(tmpdir.join('target.db'))
+        path = str(tmpdir.join('users.jsonl'))
+
+        main(['--db', source, 'export', path])
+        session = Session(bind=create_engine(source))
+        session.add_all([
+            User(username='alice', password='a', role='user'),
+            User(username='bob', password='b', role='admin'),
+        ])
+        session.commit()
+
+        main(['--db', source, 'export', path])
+        assert 'exported 2 users' in capsys.readouterr().err
+
+        main(['--db', target, 'import', path])
+        assert 'imported 2 users' in capsys.readouterr().err
+
+        session = Session(bind=create_engine(target))
+        users = {user.username: user for user in session.query(User)}
+        assert users['alice'].verify_password('a')
+        assert users['bob'].role.name == 'admin'
+
+        csv = io.StringIO()
+        assert export_users(session, csv) == 2
+        assert csv.getvalue().splitlines()[0] == \
+            'id,username,password,role,fullname,created,updated'
@@ -1,3 +1,14 @@
+from datetime import timedelta
+
+import pytest
+
+from apistar_auth import (
+    enable_signed_session_cookies,
+    Keyring,
+    revoke_signed_sessions,
+    User,
+    UserSession,
+)
 from apistar_auth.cookies import get_session_cookie, SESSION_COOKIE_NAME
 
 from .testutil import TestCaseUnauthenticatedBase
@@ -9,3 +20,72 @@ class TestCaseLogin(TestCaseUnauthenticatedBase):
         cookie = get_session_cookie(url, 'session value')
         assert cookie[SESSION_COOKIE_NAME]['httponly']
         assert cookie[SESSION_COOKIE_NAME]['secure']
+
+
+class TestCaseSignedCookies(TestCaseUnauthenticatedBase):
+    @pytest.fixture(scope='function')
+    def keyring(self):
+        keyring = Keyring()
+        keyring.rotate('k1')
+        enable_signed_session_cookies(keyring)
+        return keyring
+
+    def test_signed_cookie_without_lookup(self, client, user_data, session,
+                                          keyring):
+        cookie = self.login(client, user_data).cookies[SESSION_COOKIE_NAME]
+        assert keyring.unsign(cookie)['role'] == 'user'
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+        assert len(resp.json()) == 1
+        assert 'set-cookie' not in resp.headers
+
+        # Fresh cookies are verified without looking up the session.
+        session.query(UserSession).delete()
+        resp = client.post('/tokens')
+        assert resp.status_code == 201
+
+    def test_signed_cookie_refresh(self, client, user_data, session,
+                                   keyring):
+        cookie = self.login(client, user_data).cookies[SESSION_COOKIE_NAME]
+        enable_signed_session_cookies(keyring, refresh_after=timedelta(0))
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+        refreshed = resp.cookies[SESSION_COOKIE_NAME]
+        assert keyring.unsign(refreshed)['sid'] == keyring.unsign(cookie)['sid']
+
+        # Cookies due for a refresh are checked against the session store.
+        session.query(UserSession).delete()
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 401
+
+    def test_signed_cookie_revocation(self, client, user_data, session,
+                                      keyring):
+        self.login(client, user_data)
+
+        user = session.query(User).filter_by(username='user').one()
+        revoke_signed_sessions(session, user)
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 401
+
+        resp = client.post('/login', json=user_data)
+        assert resp.status_code == 200
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+
+    def test_signed_cookie_tampered(self, client, user_data, keyring):
+        cookie = self.login(client, user_data).cookies[SESSION_COOKIE_NAME]
+        data, key_id, signature = cookie.split('.')
+
+        client.cookies[SESSION_COOKIE_NAME] = \
+            '.'.join([data, key_id, signature[:-2] + 'AA'])
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 401
+
+        keyring.rotate('k2')
+        keyring.remove('k1')
+        client.cookies[SESSION_COOKIE_NAME] = cookie
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 401
@@ -1,5 +1,18 @@
+import threading
+import time
+
+import pytest
+
 from .testutil import TestCaseUnauthenticatedBase
-from apistar_auth import User, enable_bcrypt_hasher
+from apistar_auth import (
+    calibrate_bcrypt_hasher,
+    configure_hashing_executor,
+    enable_bcrypt_hasher,
+    HasherBusy,
+    User,
+)
+from apistar_auth import hasher
+from apistar_auth.hasher import HashingExecutor
 
 
 class TestCaseUsers(TestCaseUnauthenticatedBase):
@@ -20,3 +33,137 @@ class TestCaseUsers(TestCaseUnauthenticatedBase):
         user_data['password'] = '#' * 73
         u = User(**user_data)
         assert not u.verify_password('#' * 72)
+
+    def test_hashing_executor_counts_hashes(self, user_data):
+        executor = configure_hashing_executor(max_workers=2, max_queue=2)
+
+        u = User(**user_data)
+        assert u.verify_password(user_data['password'])
+
+        stats = executor.stats()
+        assert stats['calls'] == 2
+        assert stats['rejected'] == 0
+        assert stats['pending'] == 0
+        assert stats['hash_time'] > 0
+        assert stats['queue_wait'] >= 0
+
+    def test_hashing_executor_rejects_when_full(self):
+        executor = HashingExecutor(max_workers=1, max_queue=1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+            return True
+
+        threads = [threading.Thread(target=executor.run, args=(block,))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+
+        # Wait until the second hash is queued behind the running one.
+        while executor.stats()['pending'] < 2:
+            time.sleep(0.001)
+
+        with pytest.raises(HasherBusy) as exc_info:
+            executor.run(block)
+        assert exc_info.value.status_code == 503
+
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        stats = executor.stats()
+        assert stats['calls'] == 2
+        assert stats['rejected'] == 1
+        assert stats['pending'] == 0
+        executor.shutdown()
+
+    def test_login_busy_hasher(self, client, user_data):
+        resp = client.post('/users', json=user_data)
+        assert resp.status_code == 201
+
+        configure_hashing_executor(max_workers=1, max_queue=0)
+        release = threading.Event()
+        thread = threading.Thread(target=hasher.executor.run,
+                                  args=(lambda: release.wait(5),))
+        thread.start()
+        while hasher.executor.stats()['pending'] < 1:
+            time.sleep(0.001)
+
+        resp = client.post('/login', json=user_data)
+        assert resp.status_code == 503
+        assert resp.json()['error'] == 'password hasher is busy'
+
+        release.set()
+        thread.join()
+
+        resp = client.post('/login', json=user_data)
+        assert resp.status_code == 200
+
+    def test_hasher_is_cached(self):
+        assert hasher.hasher() is hasher.hasher()
+
+        context = hasher.hasher()
+        enable_bcrypt_hasher(rounds=4)
+        assert hasher.hasher() is not context
+
+    def test_rehash_legacy_password_on_login(self, client, user_data,
+                                             session):
+        # The user is created with the (legacy) ldap_sha1 hasher.
+        resp = client.post('/users', json=user_data)
+        assert resp.status_code == 201
+
+        user = session.query(User).filter_by(username='user').one()
+        assert user.password.startswith('{SHA}')
+
+        enable_bcrypt_hasher(rounds=4)
+        resp = client.post('/login', json=user_data)
+        assert resp.status_code == 200
+
+        session.refresh(user)
+        assert user.password.startswith('$bcrypt-sha256$2b,4$')
+
+        # The stored hash is upgraded when the cost is raised.
+        enable_bcrypt_hasher(rounds=5)
+        resp = client.post('/login', json=user_data)
+        assert resp.status_code == 200
+
+        session.refresh(user)
+        assert user.password.startswith('$bcrypt-sha256$2b,5$')
+        assert user.verify_password(user_data['password'])
+
+    def test_no_rehash_on_failed_login(self, client, user_data, session):
+        resp = client.post('/users', json=user_data)
+        assert resp.status_code == 201
+
+        user = session.query(User).filter_by(username='user').one()
+        password_hash = user.password
+
+        enable_bcrypt_hasher(rounds=4)
+        user_data['password'] = 'invalid'
+        resp = client.post('/login', json=user_data)
+        assert resp.status_code == 400
+
+        session.refresh(user)
+        assert user.password == password_hash
+
+    def test_calibrate_bcrypt_hasher(self):
+        result = calibrate_bcrypt_hasher(target_latency=60, min_rounds=4,
+                                         max_rounds=5, samples=1)
+        assert result['rounds'] == 5
+        assert sorted(result['timings']) == [4, 5]
+        assert all(t > 0 for t in result['timings'].values())
+        assert hasher.calibration is result
+        assert hasher.bcrypt_rounds == 5
+        assert hasher.hasher().hash('x').startswith('$bcrypt-sha256$2b,5$')
+
+    def test_calibrate_bcrypt_hasher_too_slow(self):
+        # Even the minimum number of rounds exceeds the target latency.
+        result = calibrate_bcrypt_hasher(target_latency=0, min_rounds=4,
+                                         max_rounds=10, samples=1)
+        assert result['rounds'] == 4
+        assert sorted(result['timings']) == [4]
+        assert hasher.bcrypt_rounds == 4
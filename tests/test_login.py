@@ -3,7 +3,7 @@ import pytest
 
 from .testutil import TestCaseUnauthenticatedBase
 
-from apistar_auth import UserSession
+from apistar_auth import SessionPruner, UserSession
 from apistar_auth.users import session_expires_after, session_update_delay
 
 
@@ -38,6 +38,7 @@ class TestCaseLogin(TestCaseUnauthenticatedBase):
 
     @pytest.fixture(scope='function', params=[True, False])
     def use_session_endpoint(self, request):
+        # Expired sessions are pruned by either the endpoint or the pruner.
         return request.param
 
     def test_purge_expired_sessions(self, client, user_data, session,
@@ -65,8 +66,10 @@ class TestCaseLogin(TestCaseUnauthenticatedBase):
             resp = client.delete('/users/sessions/expired')
             assert resp.status_code == 200
         else:
+            # Logging in no longer prunes expired sessions.
             resp = client.post('/login', json=user_data)
             assert resp.status_code == 200
+            assert SessionPruner(None).run_once(session) == 1
 
         sessions = session.query(UserSession) \
             .filter(UserSession.user_id == user_id).all()
@@ -76,7 +79,7 @@ class TestCaseLogin(TestCaseUnauthenticatedBase):
         else:
             assert len(sessions) == 2
 
-        assert sessions[0].id != session_id
+        assert session_id not in [s.id for s in sessions]
 
     def test_reject_expired_session(self, client, user_data, session):
         resp = client.post('/users', json=user_data)
@@ -97,10 +100,35 @@ class TestCaseLogin(TestCaseUnauthenticatedBase):
         resp = client.get('/users/sessions')
         assert resp.status_code == 401
 
+        # The expired session is left to the session pruner.
+        sessions = session.query(UserSession) \
+            .filter(UserSession.user_id == user_id).all()
+        assert len(sessions) == 1
+
+        assert SessionPruner(None).run_once(session) == 1
         sessions = session.query(UserSession) \
             .filter(UserSession.user_id == user_id).all()
         assert len(sessions) == 0
 
+    def test_prune_in_batches(self, client, user_data, session):
+        resp = client.post('/users', json=user_data)
+        assert resp.status_code == 201
+
+        for _ in range(5):
+            resp = client.post('/login', json=user_data)
+            assert resp.status_code == 200
+
+        expired = datetime.utcnow() - session_expires_after
+        session.query(UserSession).update({'updated': expired},
+                                          synchronize_session=False)
+
+        pruner = SessionPruner(None, batch_size=2)
+        assert pruner.run_once(session) == 5
+        assert pruner.last_run['rows'] == 5
+        assert pruner.last_run['batches'] == 3
+        assert pruner.total_rows == 5
+        assert session.query(UserSession).count() == 0
+
     def test_throttle_session_update(self, client, user_data, session):
         resp = client.post('/users', json=user_data)
         assert resp.status_code == 201
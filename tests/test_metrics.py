@@ -0,0 +1,106 @@
+import threading
+
+from apistar import App, TestClient
+
+from apistar_auth import (
+    enable_session_cache,
+    metrics_routes,
+    metrics_snapshot,
+    reset_metrics,
+    User,
+)
+from apistar_auth.metrics import Counter, Histogram, registry, render
+
+from .testutil import TestCaseUnauthenticatedBase
+
+
+class TestCaseMetrics(TestCaseUnauthenticatedBase):
+    def test_counter_threads(self):
+        counter = Counter('test_total', 'Test counter.', ['kind'])
+        registry.remove(counter)
+
+        def work():
+            for _ in range(1000):
+                counter.inc('a')
+            counter.inc('b', amount=5)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        # Some threads are still running while the others are collected.
+        counter.values()
+        for thread in threads:
+            thread.join()
+        counter.inc('a')
+
+        assert counter.values() == {('a',): 4001, ('b',): 20}
+        # Shards of finished threads are folded into one.
+        assert len(counter._shards) == 1
+        assert counter.values() == {('a',): 4001, ('b',): 20}
+
+        counter.reset()
+        assert counter.values() == {}
+
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', 'Test histogram.',
+                              buckets=(0.1, 1.0))
+        registry.remove(histogram)
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+
+        assert histogram.values() == {(): {
+            'buckets': [(0.1, 2), (1.0, 3), (float('inf'), 4)],
+            'count': 4,
+            'sum': 2.65,
+        }}
+
+        registry.append(histogram)
+        try:
+            text = render()
+        finally:
+            registry.remove(histogram)
+        assert '# TYPE test_seconds histogram\n' in text
+        assert 'test_seconds_bucket{le="0.1"} 2\n' in text
+        assert 'test_seconds_bucket{le="+Inf"} 4\n' in text
+        assert 'test_seconds_sum 2.65\n' in text
+        assert 'test_seconds_count 4\n' in text
+
+    def test_login_and_resolve(self, client, session, user_data):
+        reset_metrics()
+        enable_session_cache()
+        session.add(User(**user_data))
+
+        resp = client.post('/login', json=dict(user_data, password='x'))
+        assert resp.status_code == 400
+        resp = client.post('/login', json=user_data)
+        assert resp.status_code == 200
+        for _ in range(2):
+            resp = client.get('/users/sessions')
+            assert resp.status_code == 200
+
+        client.cookies.clear()
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 401
+
+        values = metrics_snapshot()
+        assert values['apistar_auth_logins_total'] == \
+            {('failure',): 1, ('success',): 1}
+        resolved = values['apistar_auth_resolve_seconds']
+        assert resolved[('cookie',)]['count'] == 2
+        assert resolved[('none',)]['count'] == 1
+        hashed = values['apistar_auth_password_hash_seconds']
+        assert hashed[('verify',)]['count'] == 2
+        assert values['apistar_auth_cache_hits_total'][('session',)] == 1
+        assert values['apistar_auth_cache_hit_ratio'][('session',)] == 0.5
+
+    def test_route(self, client, session, user_data):
+        reset_metrics()
+        session.add(User(**user_data))
+        client.post('/login', json=user_data)
+
+        metrics_client = TestClient(App(routes=metrics_routes))
+        resp = metrics_client.get('/auth/metrics')
+        assert resp.status_code == 200
+        assert resp.headers['Content-Type'] == \
+            'text/plain; version=0.0.4; charset=utf-8'
+        assert 'apistar_auth_logins_total{result="success"} 1\n' in resp.text
@@ -0,0 +1,119 @@
+import base64
+import json
+
+import pytest
+
+from .testutil import TestCaseUnauthenticatedBase
+
+from apistar_auth import (
+    KeyValueSessionStore,
+    MemorySessionStore,
+    set_session_store,
+    SQLSessionStore,
+    User,
+)
+from apistar_auth.pagination import NDJSON_MEDIA_TYPE
+from apistar_auth.stores import FakeKeyValueClient
+
+
+def next_link(resp):
+    link = resp.headers.get('link')
+    if link is None:
+        return None
+    url, rel = link.split('; ')
+    assert rel == 'rel="next"'
+    return url.strip('<>')
+
+
+class TestCasePagination(TestCaseUnauthenticatedBase):
+    def fetch_all(self, client, url):
+        pages = []
+        while url is not None:
+            resp = client.get(url)
+            assert resp.status_code == 200
+            pages.append(resp.json())
+            url = next_link(resp)
+        return pages
+
+    def test_list_users_pages(self, admin, session, user_data):
+        for i in range(4):
+            session.add(User(**dict(user_data, username='user%d' % i)))
+        session.flush()
+
+        pages = self.fetch_all(admin, '/users?limit=2')
+        assert [len(page) for page in pages] == [2, 2, 1]
+
+        ids = [user['id'] for page in pages for user in page]
+        assert ids == sorted(ids)
+        assert ids == [user['id'] for user in admin.get('/users').json()]
+
+    @pytest.mark.parametrize('store', [
+        SQLSessionStore, MemorySessionStore,
+        lambda: KeyValueSessionStore(FakeKeyValueClient()),
+    ])
+    def test_list_sessions_pages(self, client, user_data, store):
+        set_session_store(store())
+
+        resp = client.post('/users', json=user_data)
+        assert resp.status_code == 201
+        for _ in range(5):
+            resp = client.post('/login', json=user_data)
+            assert resp.status_code == 200
+
+        pages = self.fetch_all(client, '/users/sessions?limit=2')
+        assert [len(page) for page in pages] == [2, 2, 1]
+
+        sessions = [s for page in pages for s in page]
+        assert len(set(s['id'] for s in sessions)) == 5
+        updated = [s['updated'] for s in sessions]
+        assert updated == sorted(updated, reverse=True)
+
+    def test_list_tokens_pages(self, client, user_data):
+        resp = client.post('/users', json=user_data)
+        assert resp.status_code == 201
+        resp = client.post('/login', json=user_data)
+        assert resp.status_code == 200
+
+        token_ids = set()
+        for _ in range(3):
+            resp = client.post('/tokens')
+            assert resp.status_code == 201
+            token_ids.add(resp.json()['id'])
+
+        pages = self.fetch_all(client, '/tokens?limit=1')
+        assert [len(page) for page in pages] == [1, 1, 1]
+        assert {page[0]['id'] for page in pages} == token_ids
+
+    def test_ndjson(self, admin, session, user_data):
+        session.add(User(**user_data))
+        session.flush()
+
+        headers = {'Accept': NDJSON_MEDIA_TYPE}
+        resp = admin.get('/users', headers=headers)
+        assert resp.status_code == 200
+        assert resp.headers['content-type'] == NDJSON_MEDIA_TYPE
+
+        lines = resp.content.splitlines()
+        users = [json.loads(line.decode('utf-8')) for line in lines]
+        assert users == admin.get('/users').json()
+
+        resp = admin.get('/users?limit=1', headers=headers)
+        assert len(resp.content.splitlines()) == 1
+        assert next_link(resp) is not None
+
+    def test_invalid_parameters(self, admin):
+        for query in ['limit=0', 'limit=x', 'after=x', 'after=WzFd0']:
+            resp = admin.get('/users?' + query)
+            assert resp.status_code == 400, query
+
+    def test_invalid_cursors(self, client, user_data):
+        self.login(client, user_data)
+
+        for keyset in [[0, 5], [1e30, '0' * 32], [10 ** 30, '0' * 32],
+                       ['0', '0' * 32], [0, 'x'], [None, None]]:
+            cursor = base64.urlsafe_b64encode(
+                json.dumps(keyset).encode('utf-8')).decode('ascii')
+            for url in ['/users/sessions', '/tokens']:
+                resp = client.get(url, params={'after': cursor})
+                assert resp.status_code == 400, (url, keyset)
+                assert resp.json() == {'error': 'invalid cursor'}
@@ -0,0 +1,81 @@
+import pytest
+
+from apistar_auth import (
+    enable_query_profiling,
+    query_budget,
+    QueryBudgetExceeded,
+    SESSION_COOKIE_NAME,
+    Token,
+    User,
+    UserSession,
+)
+from apistar_auth.profiling import profile_queries
+
+from .testutil import TestCaseUnauthenticatedBase
+
+
+class TestCaseQueryProfiling(TestCaseUnauthenticatedBase):
+    @pytest.fixture(scope='function')
+    def user(self, session, user_data):
+        user = User(**user_data)
+        session.add(user)
+        session.flush()
+        return user
+
+    def test_server_timing(self, client, session, user_data, user):
+        resp = client.post('/login', json=user_data)
+        assert 'Server-Timing' not in resp.headers
+
+        enable_query_profiling()
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+        timing = resp.headers['Server-Timing']
+        assert timing.startswith('db;dur=')
+        assert timing.endswith(' queries"')
+
+    def test_budget_exceeded(self, session, user):
+        with pytest.raises(QueryBudgetExceeded) as info:
+            with query_budget(1):
+                session.query(User).all()
+                session.query(Token).all()
+        assert 'FROM tokens' in str(info.value)
+
+        with profile_queries() as outer:
+            with query_budget(0, savepoints=0):
+                pass
+            with session.begin_nested():
+                session.query(User).all()
+        assert outer.count == 3
+        assert outer.savepoints == 2
+
+    # The test app runs each request in a savepoint, which adds a SAVEPOINT
+    # and a RELEASE statement to every request.
+
+    def test_cookie_auth_budget(self, client, session, user):
+        user_session = UserSession(user=user)
+        session.add(user_session)
+        session.flush()
+        client.cookies[SESSION_COOKIE_NAME] = str(user_session.id)
+
+        # Resolving the user takes one query; listing takes another.
+        with query_budget(4, savepoints=2):
+            resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+
+    def test_token_auth_budget(self, client, session, user):
+        token = Token(user=user)
+        session.add(token)
+        session.flush()
+
+        # The first use of a token updates its `last_used` field.
+        with query_budget(5, savepoints=2):
+            resp = client.get('/tokens', params={'token': str(token.id)})
+        assert resp.status_code == 200
+        with query_budget(4, savepoints=2):
+            resp = client.get('/tokens', params={'token': str(token.id)})
+        assert resp.status_code == 200
+
+    def test_login_budget(self, client, user, user_data):
+        with query_budget(4, savepoints=2):
+            resp = client.post('/login', json=user_data)
+        assert resp.status_code == 200
@@ -0,0 +1,106 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event
+
+from apistar_auth import SQLSessionStore, Token, User, UserComponent
+from apistar_auth.pagination import encode_cursor
+from apistar_auth.tokens import list_tokens, prune_tokens, touch_tokens
+from apistar_auth.users import list_users
+
+from .testutil import TestCaseUnauthenticatedBase
+
+
+def explain(session, statement, parameters):
+    '''Return the query plan of a statement as a list of lines.'''
+    cursor = session.connection().connection.cursor()
+    try:
+        if session.get_bind().dialect.name == 'postgresql':
+            # Tables in the test database are tiny, so the planner would
+            # prefer a sequential scan even when an index is available.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + statement, parameters)
+            return [line for line, in cursor.fetchall()]
+
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def is_full_scan(line):
+    if line.lstrip(' ->').startswith('Seq Scan'):
+        return True
+    # SQLite reports "SCAN <table>" for a full table scan, and
+    # "SCAN <table> USING [COVERING] INDEX" for a full index scan.
+    words = line.split()
+    return words[:1] == ['SCAN'] and 'USING' not in words \
+        and 'CONSTANT' not in words
+
+
+class TestCaseQueryPlans(TestCaseUnauthenticatedBase):
+    @contextmanager
+    def assert_no_full_scan(self, session):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context,
+                   executemany):
+            statements.append((statement, parameters))
+
+        engine = session.get_bind()
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            yield
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+
+        assert statements
+        for statement, parameters in statements:
+            plan = explain(session, statement, parameters)
+            scans = [line for line in plan if is_full_scan(line)]
+            assert not scans, '{}\n{}'.format(statement, '\n'.join(plan))
+
+    def create_user(self, session, user_data):
+        user = User(**user_data)
+        session.add(user)
+        session.flush()
+        return user
+
+    def test_session_queries(self, session, user_data):
+        store = SQLSessionStore()
+        user = self.create_user(session, user_data)
+        session_id = store.create(session, user)
+        session.flush()
+        expiration_date = datetime.now(timezone.utc) - timedelta(days=1)
+
+        with self.assert_no_full_scan(session):
+            store.get(session, session_id)
+            store.touch(session, session_id)
+            store.touch_many(session, [session_id])
+            list(store.list(session, user.id))
+            list(store.list(session, user.id, (expiration_date, session_id),
+                            limit=10))
+            store.prune_batch(session, expiration_date, 10)
+            store.delete(session, session_id)
+
+    def test_token_queries(self, session, user_data):
+        user = self.create_user(session, user_data)
+        token = Token(user=user)
+        session.add(token)
+        session.flush()
+
+        with self.assert_no_full_scan(session):
+            UserComponent().resolve_with_token(session, token.id)
+            list_tokens(session, user, 'http://testserver/tokens', '10',
+                        encode_cursor((token.created, token.id)), None)
+            touch_tokens(session, [token.id])
+            prune_tokens(session)
+
+    def test_user_queries(self, session, user_data):
+        user = self.create_user(session, user_data)
+
+        with self.assert_no_full_scan(session):
+            session.query(User) \
+                .filter(User.username == user_data['username']).first()
+            list_users(session, 'http://testserver/users', '10',
+                       encode_cursor((user.id,)), None)
@@ -0,0 +1,158 @@
+import shutil
+
+from apistar import App, Component, TestClient, http
+from apistar_sqlalchemy import database
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+import pytest
+
+from apistar_auth import (
+    AuthorizationHook,
+    enable_read_replica,
+    routes,
+    SESSION_COOKIE_NAME,
+    Token,
+    User,
+    UserComponent,
+    UserSession,
+)
+
+from .testutil import TestCaseUnauthenticatedBase
+
+
+class SessionComponent(Component):
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+
+    def resolve(self) -> Session:
+        return self.session_factory()
+
+
+class CommitHook:
+    def on_response(self, response: http.Response, session: Session,
+                    exc: Exception) -> http.Response:
+        if exc is None:
+            session.commit()
+        session.close()
+        return response
+
+    def on_error(self, response: http.Response, session: Session
+                 ) -> http.Response:
+        session.rollback()
+        session.close()
+        return response
+
+
+class TestCaseReadReplica(TestCaseUnauthenticatedBase):
+    @pytest.fixture(scope='function')
+    def databases(self, tmpdir, user_data):
+        paths = [str(tmpdir.join(name)) for name in ('primary.db',
+                                                     'replica.db')]
+        primary, replica = engines = \
+            [create_engine('sqlite:///' + path) for path in paths]
+        database.Base.metadata.create_all(primary)
+
+        statements = {engine: [] for engine in engines}
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute',
+                         lambda conn, cursor, statement, *args:
+                         statements[conn.engine].append(statement))
+
+        def replicate():
+            # SQLite engines on a file do not pool connections, so the file
+            # can be copied between requests.
+            shutil.copyfile(*paths)
+
+        session = Session(bind=primary)
+        user = User(**user_data)
+        session.add_all([user, Token(user=user)])
+        session.commit()
+        session.close()
+        replicate()
+
+        enable_read_replica(sessionmaker(bind=replica))
+        app = App(routes=routes,
+                  components=[SessionComponent(sessionmaker(bind=primary)),
+                              UserComponent()],
+                  event_hooks=[AuthorizationHook(routes), CommitHook()])
+        app.debug = True
+        yield {
+            'client': TestClient(app, hostname='testserver.local'),
+            'primary': statements[primary],
+            'replica': statements[replica],
+            'session': Session(bind=primary),
+            'replicate': replicate,
+        }
+
+    def test_read_your_writes_after_login(self, databases, user_data):
+        client = databases['client']
+        resp = client.post('/login', json=user_data)
+        assert resp.status_code == 200
+
+        # The user was read from the replica, the session written to the
+        # primary.
+        assert any('FROM users' in s for s in databases['replica'])
+        assert any('INSERT INTO user_sessions' in s
+                   for s in databases['primary'])
+        assert not any('FROM users' in s for s in databases['primary'])
+
+        # The replica does not have the new session yet, so the lookup
+        # falls back to the primary.
+        del databases['replica'][:], databases['primary'][:]
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+        assert len(resp.json()) == 1
+        assert any('JOIN user_sessions' in s for s in databases['replica'])
+        assert any('JOIN user_sessions' in s for s in databases['primary'])
+
+        # Once replicated, the session lookup is served by the replica.
+        databases['replicate']()
+        del databases['replica'][:], databases['primary'][:]
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+        assert any('JOIN user_sessions' in s for s in databases['replica'])
+        assert not any('JOIN user_sessions' in s
+                       for s in databases['primary'])
+
+    def test_login_user_not_replicated(self, databases):
+        session = databases['session']
+        session.add(User(username='new', password='secret', role='user',
+                         fullname='new user'))
+        session.commit()
+
+        client = databases['client']
+        resp = client.post('/login', json={'username': 'new',
+                                           'password': 'secret'})
+        assert resp.status_code == 200
+        assert resp.json()['username'] == 'new'
+
+        resp = client.post('/login', json={'username': 'missing',
+                                           'password': 'secret'})
+        assert resp.status_code == 400
+
+    def test_token_touch_goes_to_primary(self, databases):
+        session = databases['session']
+        token = session.query(Token).one()
+
+        client = databases['client']
+        resp = client.get('/tokens', params={'token': str(token.id)})
+        assert resp.status_code == 200
+        assert any('JOIN tokens' in s for s in databases['replica'])
+        assert any(s.startswith('UPDATE tokens')
+                   for s in databases['primary'])
+
+        session.expire_all()
+        assert session.query(Token).one().last_used is not None
+
+    def test_session_touch_goes_to_primary(self, databases, user_data):
+        session = databases['session']
+        user = session.query(User).one()
+        user_session = UserSession(user=user)
+        session.add(user_session)
+        session.commit()
+
+        client = databases['client']
+        client.cookies[SESSION_COOKIE_NAME] = str(user_session.id)
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+        assert not any(s.startswith('UPDATE') for s in databases['replica'])
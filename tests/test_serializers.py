@@ -0,0 +1,50 @@
+from apistar_auth import SQLSessionStore, Token, User, UserSession
+from apistar_auth.tokens import serialize_token, TokenType
+from apistar_auth.users import (
+    attribute_names,
+    serialize_user,
+    serialize_user_session,
+    UserSessionType,
+    UserType,
+)
+
+from .testutil import TestCaseUnauthenticatedBase
+
+
+class TestCaseSerializers(TestCaseUnauthenticatedBase):
+    def test_attribute_names_are_cached(self):
+        assert attribute_names(User) is attribute_names(User)
+        assert 'password' in attribute_names(User)
+        assert 'sessions' not in attribute_names(User)
+
+    def test_matches_validated_types(self, session, user_data):
+        user = User(**user_data)
+        token = Token(user=user)
+        session.add_all([UserSession(user=user), token])
+        session.flush()
+
+        assert serialize_user(user) == dict(UserType(user))
+        assert serialize_token(token) == dict(TokenType(token))
+
+        user_session = session.query(UserSession).one()
+        assert serialize_user_session(user_session) == \
+            dict(UserSessionType(user_session))
+
+        # Result rows of column queries serialize like ORM instances.
+        columns = [getattr(User, key) for key in serialize_user.fields]
+        row = session.query(*columns).one()
+        assert serialize_user(row) == serialize_user(user)
+
+    def test_dict_rows(self, session, user_data):
+        user = User(**user_data)
+        session.add(user)
+        session.flush()
+
+        store = SQLSessionStore()
+        store.create(session, user)
+        session.flush()
+        user_session = session.query(UserSession).one()
+        record = {key: getattr(user_session, key)
+                  for key in ('id', 'user_id', 'created', 'updated')}
+        assert serialize_user_session(record) == \
+            serialize_user_session(user_session)
@@ -0,0 +1,39 @@
+from apistar_auth import Keyring
+
+
+class TestCaseSigning(object):
+    def test_sign_and_unsign(self):
+        keyring = Keyring()
+        keyring.rotate('k1')
+
+        value = keyring.sign({'a': 1})
+        assert value.split('.')[1] == 'k1'
+        assert keyring.unsign(value) == {'a': 1}
+
+    def test_reject_tampered_values(self):
+        keyring = Keyring()
+        keyring.rotate('k1')
+        data, key_id, signature = keyring.sign({'a': 1}).split('.')
+
+        other = Keyring()
+        other.rotate('k1')
+        forged = other.sign({'a': 2}).split('.')[0]
+
+        assert keyring.unsign('.'.join([forged, key_id, signature])) is None
+        assert keyring.unsign('.'.join([data, 'k2', signature])) is None
+        assert keyring.unsign(data) is None
+        assert keyring.unsign('a.b.c') is None
+
+    def test_key_rotation(self):
+        keyring = Keyring({'k1': b'secret'})
+        old = keyring.sign({'a': 1})
+
+        keyring.rotate('k2')
+        new = keyring.sign({'a': 2})
+        assert new.split('.')[1] == 'k2'
+        assert keyring.unsign(old) == {'a': 1}
+        assert keyring.unsign(new) == {'a': 2}
+
+        keyring.remove('k1')
+        assert keyring.unsign(old) is None
+        assert keyring.unsign(new) == {'a': 2}
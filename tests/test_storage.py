@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta, timezone
+import uuid
+
+from apistar_sqlalchemy import database
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+import pytest
+
+from apistar_auth import (
+    enable_compact_storage,
+    migrate_storage,
+    Token,
+    User,
+    UserSession,
+)
+
+from .testutil import TestCaseUnauthenticatedBase
+
+
+class TestCaseCompactStorage(TestCaseUnauthenticatedBase):
+    def compact_engine(self):
+        engine = create_engine('sqlite://')
+        enable_compact_storage(engine)
+        database.Base.metadata.create_all(engine)
+        return engine
+
+    def test_compact_column_storage(self, user_data):
+        engine = self.compact_engine()
+        session = Session(bind=engine)
+
+        user = User(**user_data)
+        user_session = UserSession(user=user)
+        session.add(user_session)
+        session.commit()
+
+        row = engine.execute('SELECT typeof(id), typeof(updated) '
+                             'FROM user_sessions').fetchone()
+        assert tuple(row) == ('blob', 'integer')
+
+        # Server-side defaults are stored as epoch microseconds as well.
+        updated = session.query(UserSession.updated).scalar()
+        assert abs(datetime.now(timezone.utc) - updated) < timedelta(seconds=5)
+
+        expires = datetime(2030, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc)
+        session.add(Token(user=user, expires=expires))
+        session.commit()
+
+        token = session.query(Token).one()
+        assert token.expires == expires
+        assert session.query(Token).get(token.id) is token
+        assert session.query(Token).filter(Token.id == token.id.hex).one() \
+            is token
+        assert session.query(Token) \
+            .filter(Token.expires > expires - timedelta(microseconds=1)) \
+            .count() == 1
+
+    def test_unsupported_dialect(self):
+        engine = create_engine('postgresql://', strategy='mock',
+                               executor=None)
+        with pytest.raises(ValueError):
+            enable_compact_storage(engine)
+
+    def test_migrate_storage(self, user_data):
+        source = create_engine('sqlite://')
+        database.Base.metadata.create_all(source)
+
+        session = Session(bind=source)
+        user = User(**user_data)
+        session.add_all([UserSession(user=user), Token(user=user)])
+        session.commit()
+
+        session_id = session.query(UserSession.id).scalar()
+        assert isinstance(session_id, uuid.UUID)
+        created = session.query(UserSession.created).scalar()
+
+        target = create_engine('sqlite://')
+        enable_compact_storage(target)
+        copied = migrate_storage(source, target, batch_size=1)
+        assert copied == {'users': 1, 'user_sessions': 1, 'tokens': 1}
+
+        session = Session(bind=target)
+        user_session = session.query(UserSession).one()
+        assert user_session.id == session_id
+        assert user_session.created == created
+        assert user_session.user.username == user_data['username']
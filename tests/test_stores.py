@@ -0,0 +1,138 @@
+from datetime import datetime, timezone
+import time
+import uuid
+
+import pytest
+
+from .testutil import TestCaseUnauthenticatedBase
+
+from apistar_auth import (
+    enable_session_cache,
+    KeyValueSessionStore,
+    MemorySessionStore,
+    SessionPruner,
+    set_session_store,
+    SESSION_COOKIE_NAME,
+    SQLSessionStore,
+    UserSession,
+)
+from apistar_auth.stores import FakeKeyValueClient
+from apistar_auth.users import session_expires_after, session_update_delay
+
+
+def memory_store():
+    return MemorySessionStore()
+
+
+def key_value_store():
+    return KeyValueSessionStore(FakeKeyValueClient())
+
+
+class TestCaseStores(TestCaseUnauthenticatedBase):
+    @pytest.fixture(scope='function', params=[memory_store, key_value_store])
+    def store(self, request):
+        store = request.param()
+        set_session_store(store)
+        return store
+
+    def test_login_and_list_sessions(self, client, user_data, session,
+                                     store):
+        user_id = self.login(client, user_data).json()['id']
+
+        resp = client.post('/login', json=user_data)
+        assert resp.status_code == 200
+        session_id = resp.cookies[SESSION_COOKIE_NAME]
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+        body = resp.json()
+        assert len(body) == 2
+        assert session_id in [s['id'] for s in body]
+        assert all(s['user_id'] == user_id for s in body)
+
+        # Sessions are not stored in the database.
+        assert session.query(UserSession).count() == 0
+
+    def test_reject_unknown_session(self, client, store):
+        client.cookies[SESSION_COOKIE_NAME] = str(uuid.uuid4())
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 401
+
+    def test_delete_session(self, client, user_data, session, store):
+        self.login(client, user_data)
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+        session_id = uuid.UUID(resp.json()[0]['id'])
+
+        store.delete(session, session_id)
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 401
+
+    @pytest.mark.parametrize('make_store',
+                             [SQLSessionStore, memory_store, key_value_store])
+    def test_delete_cached_session(self, client, user_data, session,
+                                   make_store):
+        # A deleted session must not be resolved from the session cache.
+        enable_session_cache()
+        store = make_store()
+        set_session_store(store)
+        self.login(client, user_data)
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+        session_id = uuid.UUID(resp.json()[0]['id'])
+
+        store.delete(session, session_id)
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 401
+
+    def test_touch_session(self, client, user_data, session, store):
+        user_id = self.login(client, user_data).json()['id']
+        session_id = store.list(session, user_id)[0]['id']
+        user, updated = store.get(session, session_id)
+        assert user.id == user_id
+
+        time.sleep(0.01)
+        store.touch(session, session_id)
+        _, touched = store.get(session, session_id)
+        assert touched > updated
+
+    def test_memory_store_prune(self, client, user_data, session):
+        store = memory_store()
+        set_session_store(store)
+        user_id = self.login(client, user_data).json()['id']
+
+        record = store.list(session, user_id)[0]
+        store._sessions[record['id']]['updated'] = \
+            datetime.now(timezone.utc) - session_expires_after
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 401
+        assert len(store.list(session, user_id)) == 1
+
+        assert SessionPruner(None, batch_size=1).run_once(session) == 1
+        assert store.list(session, user_id) == []
+
+    def test_memory_store_update_delay(self, client, user_data, session):
+        store = memory_store()
+        set_session_store(store)
+        user_id = self.login(client, user_data).json()['id']
+
+        record = store.list(session, user_id)[0]
+        updated = datetime.now(timezone.utc) - session_update_delay
+        store._sessions[record['id']]['updated'] = updated
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+        assert store.list(session, user_id)[0]['updated'] > updated
+
+    def test_key_value_expiry(self):
+        client = FakeKeyValueClient()
+        client.set('a', '1', ttl=60)
+        client.set('b', '2', ttl=0.001)
+        time.sleep(0.01)
+        assert client.get('a') == '1'
+        assert client.get('b') is None
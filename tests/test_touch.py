@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta, timezone
+import os
+import tempfile
+import time
+
+from apistar_sqlalchemy import database
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import pytest
+
+from .testutil import TestCaseUnauthenticatedBase
+
+from apistar_auth import enable_touch_buffer, TouchBuffer, User, UserSession
+from apistar_auth.users import session_update_delay
+
+
+class TestCaseTouchBuffer(TestCaseUnauthenticatedBase):
+    def test_touch_is_buffered(self, client, user_data, session):
+        buffer = enable_touch_buffer(None, interval=3600)
+
+        resp = client.post('/users', json=user_data)
+        assert resp.status_code == 201
+
+        resp = client.post('/login', json=user_data)
+        assert resp.status_code == 200
+
+        user_session = session.query(UserSession).one()
+        updated = datetime.utcnow() - session_update_delay
+        user_session.updated = updated
+        session.flush()
+
+        resp = client.get('/users/sessions')
+        assert resp.status_code == 200
+        assert user_session.id in buffer
+
+        # The request itself did not touch the session.
+        session.refresh(user_session)
+        assert user_session.updated.replace(tzinfo=None) == updated
+
+        assert buffer.flush(session) == 1
+        assert len(buffer) == 0
+
+        session.refresh(user_session)
+        age = datetime.now(timezone.utc) - \
+            user_session.updated.replace(tzinfo=timezone.utc)
+        assert age < timedelta(seconds=180)
+
+    def test_failed_flush_is_requeued(self, session):
+        calls = []
+
+        def touch_many(session, session_ids):
+            calls.append(session_ids)
+            if len(calls) == 1:
+                # Touches recorded during the flush are kept as well.
+                buffer.add(3)
+                raise RuntimeError('database is locked')
+
+        buffer = TouchBuffer(None, interval=3600, touch_many=touch_many)
+        # Flushed by hand only, without a background thread.
+        buffer._stopped.set()
+        buffer.add(1)
+        buffer.add(2)
+
+        with pytest.raises(RuntimeError):
+            buffer.flush(session)
+        assert len(buffer) == 3
+        assert buffer.flushed == 0
+
+        assert buffer.flush(session) == 3
+        assert calls == [[1, 2], [1, 2, 3]]
+        assert len(buffer) == 0
+
+    def test_background_flush(self):
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        try:
+            engine = create_engine('sqlite:///' + path)
+            database.Base.metadata.create_all(engine)
+            Session = sessionmaker(bind=engine)
+
+            session = Session()
+            user = User(username='u', password='p', role='user')
+            sessions = [UserSession(user=user) for _ in range(3)]
+            session.add_all(sessions)
+            session.flush()
+            old = datetime.now(timezone.utc) - timedelta(days=2)
+            for user_session in sessions:
+                user_session.updated = old
+            session.commit()
+            session_ids = [s.id for s in sessions]
+            session.close()
+
+            # Reaching max_size wakes up the flush thread.
+            buffer = TouchBuffer(Session, interval=3600, max_size=3)
+            for session_id in session_ids:
+                buffer.add(session_id)
+
+            deadline = time.time() + 5
+            while buffer.flushed < 3 and time.time() < deadline:
+                time.sleep(0.01)
+            assert buffer.flushed == 3
+
+            buffer.add(session_ids[0])
+            buffer.stop()
+            assert buffer.flushed == 4
+
+            session = Session()
+            for user_session in session.query(UserSession).all():
+                updated = user_session.updated.replace(tzinfo=timezone.utc)
+                assert updated > old + timedelta(days=1)
+            session.close()
+            engine.dispose()
+        finally:
+            os.unlink(path)
@@ -1,4 +1,6 @@
 from .testutil import TestCaseUnauthenticatedBase
+from apistar_auth import configure_hashing_executor, hasher, users
+from apistar_auth import User, UserRole
 from datetime import datetime, timezone
 import dateutil.parser
 import uuid
@@ -165,3 +167,105 @@ class TestCaseUsers(TestCaseUnauthenticatedBase):
         resp = client.get('/users/sessions')
         assert resp.status_code == 200
         assert len(resp.json()) == 2
+
+
+class TestCaseBulkUsers(TestCaseUnauthenticatedBase):
+    def test_bulk_create_users(self, admin, client, user_data):
+        configure_hashing_executor(max_workers=2)
+
+        resp = admin.post('/users', json=user_data)
+        assert resp.status_code == 201
+
+        records = [
+            dict(user_data, username='alice'),
+            dict(user_data, username='bob', role='admin'),
+            dict(user_data, username='alice'),
+            dict(user_data),
+            {'username': 'carol', 'role': 'user'},
+            dict(user_data, username='dave', id=123),
+        ]
+        resp = admin.post('/users/bulk', json=records)
+        assert resp.status_code == 200
+        body = resp.json()
+        assert body['created'] == 2
+
+        results = body['results']
+        assert [r['index'] for r in results] == list(range(len(records)))
+        assert [r['status'] for r in results] == [
+            'created', 'created', 'duplicate', 'duplicate', 'invalid',
+            'invalid']
+        assert 'password' in results[4]['errors']
+
+        resp = admin.get('/users')
+        users = {u['username']: u for u in resp.json()}
+        assert users['alice']['id'] == results[0]['id']
+        assert users['bob']['role'] == 'admin'
+
+        resp = client.post('/login', json=dict(user_data, username='alice'))
+        assert resp.status_code == 200
+
+        # Users cannot create admins in bulk either.
+        resp = client.post('/users/bulk', json=[
+            dict(user_data, username='eve', role='admin'),
+            dict(user_data, username='frank'),
+        ])
+        assert resp.status_code == 200
+        results = resp.json()['results']
+        assert [r['status'] for r in results] == ['forbidden', 'created']
+
+    def test_bulk_create_users_errors(self, admin, client, user_data):
+        resp = client.post('/users/bulk', json=[user_data])
+        assert resp.status_code == 401
+
+        resp = admin.post('/users/bulk', json=user_data)
+        assert resp.status_code == 400
+
+        # Records that are not objects are reported, not a server error.
+        resp = admin.post('/users/bulk', json=[1, 'x', None, [], user_data])
+        assert resp.status_code == 200
+        results = resp.json()['results']
+        assert [r['status'] for r in results] == ['invalid'] * 4 + ['created']
+        assert results[2] == {'index': 2, 'status': 'invalid',
+                              'error': 'expected an object'}
+
+        # A null role is the default role.
+        resp = admin.post('/users/bulk', json=[
+            dict(user_data, username='grace', role=None)])
+        assert resp.status_code == 200
+        assert resp.json()['results'][0]['status'] == 'created'
+        resp = admin.get('/users')
+        roles = {u['username']: u['role'] for u in resp.json()}
+        assert roles['grace'] == 'user'
+
+        records = [dict(user_data, username='user%d' % i)
+                   for i in range(users.max_bulk_users + 1)]
+        resp = admin.post('/users/bulk', json=records)
+        assert resp.status_code == 400
+
+    def test_insert_users_failures(self, session, user_data):
+        session.add(User(**user_data))
+        session.flush()
+
+        rows = [
+            {'username': 'new', 'password': 'x', 'role': UserRole.user},
+            {'username': user_data['username'], 'password': 'x',
+             'role': UserRole.user},
+            {'username': 'nopassword', 'password': None,
+             'role': UserRole.user},
+        ]
+        failed = users._insert_users(session, rows)
+        assert {username: result['status']
+                for username, result in failed.items()} == {
+            user_data['username']: 'duplicate', 'nopassword': 'failed'}
+        assert session.query(User).filter_by(username='new').count() == 1
+
+    def test_encrypt_many(self):
+        executor = configure_hashing_executor(max_workers=2)
+
+        hashes = hasher.encrypt_many(['a', 'b', 'c'])
+        assert [hasher.verify(p, h) for p, h in zip('abc', hashes)] == \
+            [True] * 3
+
+        stats = executor.stats()
+        assert stats['calls'] == 6
+        assert stats['pending'] == 0
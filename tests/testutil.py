@@ -1,6 +1,9 @@
 from apistar import App, TestClient, http
 from apistar_sqlalchemy import database
 from apistar_sqlalchemy.components import SQLAlchemySessionComponent
+from apistar_sqlalchemy.event_hooks import (
+    SQLAlchemyTransactionHook as CommitTransactionHook,
+)
 import pytest
 import os
 
@@ -10,10 +13,24 @@ from apistar_auth import (
     AuthorizationHook,
     UserComponent,
     SESSION_COOKIE_NAME,
+    SignedSessionCookieHook,
     routes,
     User,
     UserSession,
+    SQLSessionStore,
+    configure_hashing_executor,
+    disable_access_tokens,
     disable_bcrypt_hasher,
+    disable_query_profiling,
+    disable_read_replica,
+    disable_session_cache,
+    disable_session_pruner,
+    disable_signed_session_cookies,
+    disable_token_cache,
+    disable_touch_buffer,
+    enable_compact_storage,
+    QueryProfilingHook,
+    set_session_store,
 )
 
 from . import db_logger  # noqa
@@ -35,15 +52,24 @@ class SQLAlchemyTransactionHook:
         return response
 
 
-def create_app(db_url: str):
+def create_app(db_url: str, compact_storage: bool = False,
+               commit: bool = False):
+    # With `commit`, every request commits its own transaction like in
+    # production (e.g. for the benchmarks), instead of running in a savepoint
+    # of the test session.
     components = [
         SQLAlchemySessionComponent(url=db_url),
         UserComponent(),
     ]
 
+    if compact_storage:
+        enable_compact_storage(components[0].engine)
+
     event_hooks = [
-        AuthorizationHook(),
-        SQLAlchemyTransactionHook(),
+        QueryProfilingHook(),
+        AuthorizationHook(routes),
+        SignedSessionCookieHook(),
+        CommitTransactionHook() if commit else SQLAlchemyTransactionHook(),
     ]
 
     # Create all SQL tables, if they do not exist.
@@ -60,7 +86,10 @@ def create_app(db_url: str):
     }
 
 
-apps = [create_app('sqlite:///:memory:')]
+apps = [
+    create_app('sqlite:///:memory:'),
+    create_app('sqlite:///:memory:', compact_storage=True),
+]
 
 if os.getenv('DATABASE_URL'):
     psql_app = create_app(os.getenv('DATABASE_URL'))
@@ -71,6 +100,16 @@ class TestCaseBase(object):
     def setup_method(self, test_method):
         # Disable bcrypt rounds to speedup testing.
         disable_bcrypt_hasher()
+        configure_hashing_executor()
+        disable_session_cache()
+        disable_token_cache()
+        set_session_store(SQLSessionStore())
+        disable_signed_session_cookies()
+        disable_access_tokens()
+        disable_touch_buffer()
+        disable_session_pruner()
+        disable_read_replica()
+        disable_query_profiling()
 
     @pytest.fixture(scope='function', params=apps)
     def app(self, request):
@@ -124,3 +163,22 @@ class TestCaseUnauthenticatedBase(TestCaseBase):
             'role': 'user',
             'fullname': 'foo bar',
         }
+
+    def login(self, client, user_data):
+        # Creates the user and logs in. Returns the login response.
+        resp = client.post('/users', json=user_data)
+        assert resp.status_code == 201
+
+        resp = client.post('/login', json=user_data)
+        assert resp.status_code == 200
+        return resp
+
+    def create_token(self, client, user_data):
+        # Logs in, creates a token and drops the session cookie again, so
+        # that the token is the only credential of the client.
+        self.login(client, user_data)
+
+        resp = client.post('/tokens')
+        assert resp.status_code == 201
+        client.cookies.clear()
+        return resp.json()['id']